@@ -1,28 +1,189 @@
-from flask import Flask, render_template, request, redirect, session, jsonify
+from flask import Flask, render_template, request, redirect, session, jsonify, g, has_request_context, abort, before_render_template, template_rendered, make_response
 from flask_sqlalchemy import SQLAlchemy
-from datetime import datetime, date
+from datetime import datetime, date, timedelta
 from sqlalchemy.dialects.postgresql import JSON
-from sqlalchemy.orm.attributes import flag_modified
-from sqlalchemy import Date
+from sqlalchemy import Date, inspect, event, func, tuple_, case
+from sqlalchemy.engine import Engine
+from sqlalchemy.exc import IntegrityError
 import math
 import json
-from firebase_admin import credentials, auth, initialize_app
+import csv
+import itertools
+import hashlib
+import gzip
+import base64
+import urllib.request
+from collections import OrderedDict, namedtuple
 import os
 import re
+import sys
+import time
+import functools
+import sqlite3
+import threading
+import random
+import heapq
+import bisect
+import cProfile
+import atexit
+from contextlib import contextmanager
+import click
+try:
+    import numpy as np
+except ImportError:
+    # only the batch ranking uses numpy, it falls back to one query at a time
+    np = None
 
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 cred_path = os.path.join(BASE_DIR, "firebase_key.json")
 
-firebase_json = json.loads(os.environ["FIREBASE_KEY"])
-cred = credentials.Certificate(firebase_json)
-initialize_app(cred)
+#firebase token verification
+# ID tokens are checked locally against Google's signing certificates. the
+# certificates are cached for as long as Google's Cache-Control allows, and
+# verified tokens are remembered by digest until they expire (capped at
+# FIREBASE_TOKEN_CACHE_SECONDS), so a login storm costs one RSA check per token
+GOOGLE_CERTS_URL = "https://www.googleapis.com/robot/v1/metadata/x509/securetoken@system.gserviceaccount.com"
+
+class GoogleKeyProvider:
+    def fetch(self):
+        with urllib.request.urlopen(GOOGLE_CERTS_URL, timeout=10) as response:
+            certs = json.loads(response.read())
+            max_age = re.search(r"max-age=(\d+)", response.headers.get("Cache-Control", ""))
+        return certs, time.time() + (int(max_age.group(1)) if max_age else 3600)
+
+class StaticKeyProvider:
+    # offline key source: a JSON file of {kid: PEM certificate}, see benchmarks/tokens.py
+    def __init__(self, path, ttl=3600):
+        self.path = path
+        self.ttl = ttl
+
+    def fetch(self):
+        with open(self.path) as f:
+            return json.load(f), time.time() + self.ttl
+
+class TokenVerifier:
+    def __init__(self, key_provider, project_id, cache_seconds=300, max_tokens=10000, refresh_interval=60):
+        self.key_provider = key_provider
+        self.project_id = project_id
+        self.cache_seconds = cache_seconds
+        self.max_tokens = max_tokens
+        self.refresh_interval = refresh_interval
+        self.lock = threading.Lock()
+        # held only while fetching certificates, so token cache hits never wait on google
+        self.fetch_lock = threading.Lock()
+        self.keys = None
+        self.keys_expire = 0
+        self.refreshed = 0
+        self.verified = OrderedDict()
+
+    def certs(self, refresh=False):
+        if self.keys is not None and time.time() < self.keys_expire:
+            # an unknown kid forces a refresh at most once per refresh_interval,
+            # by one thread while the others go on with the keys they have, so
+            # tokens with made-up kids cannot make every request a fetch
+            if not refresh or time.time() - self.refreshed < self.refresh_interval:
+                return self.keys
+            if not self.fetch_lock.acquire(blocking=False):
+                return self.keys
+            if time.time() - self.refreshed < self.refresh_interval:
+                self.fetch_lock.release()
+                return self.keys
+        else:
+            self.fetch_lock.acquire()
+            if self.keys is not None and time.time() < self.keys_expire:
+                self.fetch_lock.release()
+                return self.keys
+        try:
+            self.refreshed = time.time()
+            self.keys, self.keys_expire = self.key_provider.fetch()
+        finally:
+            self.fetch_lock.release()
+        return self.keys
+
+    def verify(self, token):
+        from google.auth import jwt as google_jwt
+        digest = hashlib.sha256(token.encode()).hexdigest()
+        now = time.time()
+        with self.lock:
+            cached = self.verified.get(digest)
+            if cached and now < cached[0]:
+                self.verified.move_to_end(digest)
+                return cached[1]
+        header = json.loads(base64.urlsafe_b64decode(token.split('.')[0] + '==='))
+        if header.get('alg') != 'RS256' or not header.get('kid'):
+            raise ValueError("token is not an RS256 Firebase ID token")
+        certs = self.certs()
+        if header['kid'] not in certs:
+            # google rotated its keys before our copy expired
+            certs = self.certs(refresh=True)
+        claims = google_jwt.decode(token, certs=certs, audience=self.project_id)
+        if claims.get('iss') != f"https://securetoken.google.com/{self.project_id}" or not claims.get('sub'):
+            raise ValueError("token was not issued for this Firebase project")
+        with self.lock:
+            self.verified[digest] = (min(claims['exp'], now + self.cache_seconds), claims)
+            while len(self.verified) > self.max_tokens:
+                self.verified.popitem(last=False)
+        return claims
+
+token_verifier = None
+
+def firebase_project_id():
+    if os.environ.get("FIREBASE_PROJECT_ID"):
+        return os.environ["FIREBASE_PROJECT_ID"]
+    if "FIREBASE_KEY" in os.environ:
+        return json.loads(os.environ["FIREBASE_KEY"])["project_id"]
+    with open(cred_path) as f:
+        return json.load(f)["project_id"]
+
+def get_token_verifier():
+    # built on first use in each worker rather than at import
+    global token_verifier
+    if token_verifier is None:
+        keys_file = os.environ.get("FIREBASE_AUTH_KEYS_FILE")
+        provider = StaticKeyProvider(keys_file) if keys_file else GoogleKeyProvider()
+        token_verifier = TokenVerifier(provider, firebase_project_id(), int(os.environ.get("FIREBASE_TOKEN_CACHE_SECONDS", 300)))
+    return token_verifier
 
 app = Flask(__name__, template_folder="templates")
 app.secret_key = "dont_look_at_my_key" 
-app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///hospitalizee.db'
+app.config['SQLALCHEMY_DATABASE_URI'] = os.environ.get('DATABASE_URL', 'sqlite:///hospitalizee.db').replace('postgres://', 'postgresql://', 1)
+if not app.config['SQLALCHEMY_DATABASE_URI'].startswith('sqlite'):
+    # server databases get a real connection pool; sqlite is tuned per connection below
+    app.config['SQLALCHEMY_ENGINE_OPTIONS'] = {
+        'pool_size': int(os.environ.get('DB_POOL_SIZE', 5)),
+        'max_overflow': int(os.environ.get('DB_MAX_OVERFLOW', 10)),
+        'pool_recycle': int(os.environ.get('DB_POOL_RECYCLE', 1800)),
+        'pool_timeout': int(os.environ.get('DB_POOL_TIMEOUT', 30)),
+        'pool_pre_ping': True,
+    }
+app.config['SQLITE_JOURNAL_MODE'] = os.environ.get('SQLITE_JOURNAL_MODE', 'WAL')
+app.config['SQLITE_SYNCHRONOUS'] = os.environ.get('SQLITE_SYNCHRONOUS', 'NORMAL')
+app.config['SQLITE_BUSY_TIMEOUT_MS'] = int(os.environ.get('SQLITE_BUSY_TIMEOUT_MS', 5000))
+# seconds a worker may serve cached hospital/bed data before checking for writes from other workers
+app.config['CACHE_MAX_STALENESS'] = float(os.environ.get('CACHE_MAX_STALENESS', 2))
+app.config['CACHE_CHANGES_KEEP_HOURS'] = float(os.environ.get('CACHE_CHANGES_KEEP_HOURS', 1))
+# fail requests that go over their declared query budget (always on in debug mode)
+app.config['ENFORCE_QUERY_BUDGET'] = os.environ.get('ENFORCE_QUERY_BUDGET') == '1'
+# fraction of requests to run under cProfile; the slowest PROFILE_KEEP of those are dumped to PROFILE_DIR
+app.config['PROFILE_SAMPLE_RATE'] = float(os.environ.get('PROFILE_SAMPLE_RATE', 0))
+app.config['PROFILE_DIR'] = os.environ.get('PROFILE_DIR', os.path.join(app.instance_path, 'profiles'))
+app.config['PROFILE_KEEP'] = int(os.environ.get('PROFILE_KEEP', 10))
+# serve rarely-changing pages from the rendered page cache (PAGE_CACHE=0 to render every time)
+app.config['PAGE_CACHE'] = os.environ.get('PAGE_CACHE', '1') != '0'
+# background job threads per process (0 = only run jobs via job_queue.run_pending())
+app.config['JOB_WORKERS'] = int(os.environ.get('JOB_WORKERS', 2))
+app.config['JOB_MAX_ATTEMPTS'] = int(os.environ.get('JOB_MAX_ATTEMPTS', 5))
+app.config['JOB_POLL_SECONDS'] = float(os.environ.get('JOB_POLL_SECONDS', 1))
+# a running job not finished after this long is assumed lost with its worker and retried
+app.config['JOB_TIMEOUT'] = int(os.environ.get('JOB_TIMEOUT', 300))
+# how long shutdown keeps running due jobs before giving up on them (they stay queued)
+app.config['JOB_DRAIN_SECONDS'] = float(os.environ.get('JOB_DRAIN_SECONDS', 10))
+# finished jobs, and so their idempotency keys, are kept this long
+app.config['JOB_KEEP_HOURS'] = float(os.environ.get('JOB_KEEP_HOURS', 24))
+# emergency bookings are POSTed here as JSON for the hospital (unset = no notifications)
+app.config['HOSPITAL_NOTIFY_URL'] = os.environ.get('HOSPITAL_NOTIFY_URL')
 db = SQLAlchemy(app)
 
-today = date.today() #hello
 def haversine(lat1, lon1, lat2, lon2):
     R = 6371  # Earth radius in KM
     lat1, lon1, lat2, lon2 = map(math.radians, [lat1, lon1, lat2, lon2])
@@ -34,6 +195,732 @@ def haversine(lat1, lon1, lat2, lon2):
     return R * c
 
 
+@event.listens_for(Engine, "connect")
+def configure_sqlite(dbapi_connection, connection_record):
+    # WAL lets readers run alongside the single writer, and busy_timeout makes
+    # concurrent writers from other gunicorn workers wait instead of failing
+    if not isinstance(dbapi_connection, sqlite3.Connection):
+        return
+    cursor = dbapi_connection.cursor()
+    cursor.execute(f"PRAGMA journal_mode={app.config['SQLITE_JOURNAL_MODE']}")
+    cursor.execute(f"PRAGMA synchronous={app.config['SQLITE_SYNCHRONOUS']}")
+    cursor.execute(f"PRAGMA busy_timeout={app.config['SQLITE_BUSY_TIMEOUT_MS']}")
+    cursor.close()
+
+
+#instrumentation
+# per request: SQL statement count and time, template render time and named
+# spans, reported in a Server-Timing header and aggregated per worker for /metrics
+@event.listens_for(Engine, "before_cursor_execute")
+def count_query(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault('query_start', []).append(time.perf_counter())
+    if has_request_context():
+        g.query_count = g.get('query_count', 0) + 1
+
+@event.listens_for(Engine, "after_cursor_execute")
+def time_query(conn, cursor, statement, parameters, context, executemany):
+    elapsed = time.perf_counter() - conn.info['query_start'].pop()
+    if has_request_context():
+        g.query_time = g.get('query_time', 0) + elapsed
+
+@event.listens_for(Engine, "handle_error")
+def drop_query_timer(context):
+    starts = context.connection.info.get('query_start') if context.connection is not None else None
+    if starts:
+        starts.pop()
+
+@contextmanager
+def span(name):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        if has_request_context():
+            spans = g.setdefault('spans', {})
+            spans[name] = spans.get(name, 0) + time.perf_counter() - start
+
+@before_render_template.connect_via(app)
+def start_template_timer(sender, template, context, **extra):
+    g.template_start = time.perf_counter()
+
+@template_rendered.connect_via(app)
+def stop_template_timer(sender, template, context, **extra):
+    g.template_time = g.get('template_time', 0) + time.perf_counter() - g.pop('template_start', time.perf_counter())
+
+class RequestMetrics:
+    BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5)
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.endpoints = {}
+        self.spans = {}
+
+    def record(self, endpoint, total, query_count, query_time, template_time, spans):
+        with self.lock:
+            stats = self.endpoints.setdefault(endpoint, {'count': 0, 'seconds': 0.0, 'queries': 0, 'query_seconds': 0.0, 'template_seconds': 0.0, 'buckets': [0] * len(self.BUCKETS)})
+            stats['count'] += 1
+            stats['seconds'] += total
+            stats['queries'] += query_count
+            stats['query_seconds'] += query_time
+            stats['template_seconds'] += template_time
+            for i, bound in enumerate(self.BUCKETS):
+                if total <= bound:
+                    stats['buckets'][i] += 1
+            for name, elapsed in spans.items():
+                calls, seconds = self.spans.get(name, (0, 0.0))
+                self.spans[name] = (calls + 1, seconds + elapsed)
+
+    def render(self):
+        lines = [
+            '# TYPE hospitalizee_request_duration_seconds histogram',
+            '# TYPE hospitalizee_sql_queries_total counter',
+            '# TYPE hospitalizee_sql_seconds_total counter',
+            '# TYPE hospitalizee_template_seconds_total counter',
+            '# TYPE hospitalizee_span_seconds_total counter',
+            '# TYPE hospitalizee_span_calls_total counter',
+        ]
+        with self.lock:
+            for endpoint, stats in sorted(self.endpoints.items()):
+                label = f'endpoint="{endpoint}"'
+                for bound, count in zip(self.BUCKETS, stats['buckets']):
+                    lines.append(f'hospitalizee_request_duration_seconds_bucket{{{label},le="{bound}"}} {count}')
+                lines.append(f'hospitalizee_request_duration_seconds_bucket{{{label},le="+Inf"}} {stats["count"]}')
+                lines.append(f'hospitalizee_request_duration_seconds_sum{{{label}}} {stats["seconds"]:.6f}')
+                lines.append(f'hospitalizee_request_duration_seconds_count{{{label}}} {stats["count"]}')
+                lines.append(f'hospitalizee_sql_queries_total{{{label}}} {stats["queries"]}')
+                lines.append(f'hospitalizee_sql_seconds_total{{{label}}} {stats["query_seconds"]:.6f}')
+                lines.append(f'hospitalizee_template_seconds_total{{{label}}} {stats["template_seconds"]:.6f}')
+            for name, (calls, seconds) in sorted(self.spans.items()):
+                lines.append(f'hospitalizee_span_seconds_total{{span="{name}"}} {seconds:.6f}')
+                lines.append(f'hospitalizee_span_calls_total{{span="{name}"}} {calls}')
+        return "\n".join(lines) + "\n"
+
+request_metrics = RequestMetrics()
+
+# (duration, path) of the profiles currently kept on disk, fastest first
+slow_profiles = []
+slow_profiles_lock = threading.Lock()
+
+def keep_profile(profiler, total):
+    keep = app.config['PROFILE_KEEP']
+    with slow_profiles_lock:
+        if len(slow_profiles) >= keep and total <= slow_profiles[0][0]:
+            return
+        os.makedirs(app.config['PROFILE_DIR'], exist_ok=True)
+        name = f"{int(total * 1000):06d}ms-{request.endpoint}-{int(time.time() * 1000)}.prof"
+        path = os.path.join(app.config['PROFILE_DIR'], name)
+        profiler.dump_stats(path)
+        heapq.heappush(slow_profiles, (total, path))
+        while len(slow_profiles) > keep:
+            _, dropped = heapq.heappop(slow_profiles)
+            if os.path.exists(dropped):
+                os.remove(dropped)
+
+@app.before_request
+def start_request_timer():
+    g.request_start = time.perf_counter()
+    rate = app.config['PROFILE_SAMPLE_RATE']
+    if rate and random.random() < rate:
+        g.profiler = cProfile.Profile()
+        g.profiler.enable()
+
+@app.after_request
+def report_request_timing(response):
+    if 'request_start' not in g:
+        return response
+    total = time.perf_counter() - g.request_start
+    profiler = g.pop('profiler', None)
+    if profiler:
+        profiler.disable()
+        keep_profile(profiler, total)
+    query_count = g.get('query_count', 0)
+    query_time = g.get('query_time', 0)
+    template_time = g.get('template_time', 0)
+    spans = g.get('spans', {})
+    timings = [f'sql;dur={query_time * 1000:.2f};desc="{query_count} queries"']
+    if template_time:
+        timings.append(f'tmpl;dur={template_time * 1000:.2f}')
+    timings += [f'{name};dur={elapsed * 1000:.2f}' for name, elapsed in spans.items()]
+    timings.append(f'total;dur={total * 1000:.2f}')
+    response.headers['Server-Timing'] = ", ".join(timings)
+    request_metrics.record(request.endpoint or 'unknown', total, query_count, query_time, template_time, spans)
+    return response
+
+@app.route('/metrics')
+def metrics():
+    # Prometheus text format for this worker, only served on loopback
+    if request.remote_addr not in ('127.0.0.1', '::1'):
+        abort(404)
+    return request_metrics.render(), 200, {'Content-Type': 'text/plain; version=0.0.4'}
+
+
+#query budget
+class QueryBudgetExceeded(Exception):
+    pass
+
+def query_budget(limit):
+    # declares the most SQL statements a route may run. statements that load or
+    # catch up an in-memory cache are left out: create_app() warms the caches
+    # and a catch-up is shared by every request after it. version checks count
+    def decorator(view):
+        @functools.wraps(view)
+        def wrapper(*args, **kwargs):
+            response = view(*args, **kwargs)
+            count = g.get('query_count', 0) - g.get('cache_query_count', 0)
+            if count > limit and (app.debug or app.config['ENFORCE_QUERY_BUDGET']):
+                raise QueryBudgetExceeded(f"{request.method} {request.path} ran {count} queries, budget is {limit}")
+            return response
+        return wrapper
+    return decorator
+
+@contextmanager
+def cache_fill():
+    # marks the statements run inside as cache maintenance for query_budget
+    before = g.get('query_count', 0) if has_request_context() else 0
+    try:
+        yield
+    finally:
+        if has_request_context():
+            g.cache_query_count = g.get('cache_query_count', 0) + g.get('query_count', 0) - before
+
+
+#versioned caches
+# each cache is loaded once per worker and shared between workers through a
+# version counter in the cache_version table: writers bump the counter in the
+# same transaction as their change and apply it locally (write-through), other
+# workers notice the new version within CACHE_MAX_STALENESS seconds and reload.
+# a cache with a refresh function catches up instead: writers record() the ids
+# they touched, bump() logs them in cache_change under the new version, and
+# readers hand refresh() every change since their version. a missing log entry
+# (purged, or a writer that recorded nothing) falls back to a full reload
+versioned_caches = []
+
+class VersionedCache:
+    def __init__(self, name, loader, refresh=None):
+        self.name = name
+        self.loader = loader
+        self.refresh = refresh
+        self.value = None
+        self.version = None
+        self.checked = 0
+        # one thread per worker loads or catches up, the others keep the value they have
+        self.lock = threading.Lock()
+        versioned_caches.append(self)
+
+    def current_version(self):
+        return db.session.query(CacheVersion.version).filter(CacheVersion.name == self.name).scalar() or 0
+
+    def get(self):
+        if self.value is None or time.monotonic() - self.checked >= app.config['CACHE_MAX_STALENESS']:
+            # only a cold cache waits for the thread that is loading it
+            if not self.lock.acquire(blocking=self.value is None):
+                return self.value
+            try:
+                if self.value is None or time.monotonic() - self.checked >= app.config['CACHE_MAX_STALENESS']:
+                    self.sync()
+            finally:
+                self.lock.release()
+        return self.value
+
+    def sync(self):
+        version = self.current_version()
+        with cache_fill():
+            if self.value is not None and version != self.version:
+                changes = self.changes_since(version) if self.refresh else None
+                if changes is None:
+                    self.value = None
+                else:
+                    self.refresh(self.value, changes)
+            if self.value is None:
+                self.value = self.loader()
+        self.version = version
+        self.checked = time.monotonic()
+
+    def changes_since(self, version):
+        # the logged changes after self.version up to `version`, or None when any is missing
+        if self.version is None or version < self.version:
+            return None
+        rows = (
+            db.session.query(CacheChange.change)
+            .filter(CacheChange.name == self.name, CacheChange.version > self.version, CacheChange.version <= version)
+            .order_by(CacheChange.version)
+            .all()
+        )
+        return [row.change for row in rows] if len(rows) == version - self.version else None
+
+    def record(self, **ids):
+        # notes what the current transaction changed (lists of ids by kind) for bump() to log
+        change = db.session.info.setdefault(('cache_change', self.name), {})
+        for kind, values in ids.items():
+            change.setdefault(kind, []).extend(values)
+
+    def bump(self):
+        # call inside the writing transaction, before commit
+        version = db.session.execute(
+            db.update(CacheVersion).where(CacheVersion.name == self.name)
+            .values(version=CacheVersion.version + 1).returning(CacheVersion.version)
+        ).scalar()
+        if version is None:
+            version = 1
+            db.session.add(CacheVersion(name=self.name, version=version))
+        change = db.session.info.pop(('cache_change', self.name), None)
+        if self.refresh and change is not None:
+            db.session.add(CacheChange(name=self.name, version=version, change=change))
+        return version
+
+    def apply(self, version, change):
+        # call after commit with the version returned by bump()
+        with self.lock:
+            if self.value is None:
+                return
+            change(self.value)
+            if self.version is not None and version == self.version + 1:
+                self.version = version
+            elif self.version is None or version > self.version:
+                # another worker wrote in between, catch up on the next read
+                self.checked = 0
+
+    def expire(self):
+        # check the version (and catch up) on the next read
+        self.checked = 0
+
+    def clear(self):
+        with self.lock:
+            self.value = None
+            self.version = None
+
+
+#page cache
+# rendered GET responses of pages that rarely change, kept gzipped as well and
+# served with an ETag. each page names the invalidation key its content depends
+# on; writers bump that key's version before committing and clear() it after,
+# and the other workers drop their copies like any other VersionedCache
+PAGE_CACHE_ENTRIES = 1000
+page_caches = {}
+
+def page_cache(key):
+    if key not in page_caches:
+        page_caches[key] = VersionedCache(f'pages:{key}', OrderedDict)
+    return page_caches[key]
+
+def page_response(entry, cache_control):
+    body, gzipped, etag, mimetype = entry
+    encoding = 'gzip' if 'gzip' in request.accept_encodings else None
+    if encoding:
+        body, etag = gzipped, etag + '-gz'
+    if etag in request.if_none_match:
+        response = app.response_class(status=304)
+    else:
+        response = app.response_class(body, mimetype=mimetype)
+        if encoding:
+            response.headers['Content-Encoding'] = encoding
+    response.set_etag(etag)
+    response.vary.add('Accept-Encoding')
+    response.headers['Cache-Control'] = cache_control
+    return response
+
+def cached_page(key, vary=lambda: '', cache_control='no-cache'):
+    # vary() returns the part of the cache key that depends on the request, or
+    # None to skip the cache (e.g. not logged in, so the view redirects)
+    def decorator(view):
+        @functools.wraps(view)
+        def wrapper(*args, **kwargs):
+            variant = vary() if request.method == 'GET' and app.config['PAGE_CACHE'] else None
+            if variant is None:
+                return view(*args, **kwargs)
+            entries = page_cache(key).get()
+            name = (request.full_path, variant)
+            entry = entries.get(name)
+            if entry is None:
+                response = make_response(view(*args, **kwargs))
+                if response.status_code != 200 or response.direct_passthrough:
+                    return response
+                body = response.get_data()
+                entry = (body, gzip.compress(body, 6), hashlib.md5(body).hexdigest(), response.mimetype)
+                entries[name] = entry
+                while len(entries) > PAGE_CACHE_ENTRIES:
+                    entries.popitem(last=False)
+            else:
+                entries.move_to_end(name)
+            return page_response(entry, cache_control)
+        return wrapper
+    return decorator
+
+
+#background jobs
+# work that does not have to finish before the response goes out. handlers add
+# a job to their own transaction with enqueue(), so it exists only if their
+# change committed; worker threads then claim due jobs with a conditional
+# update (safe across gunicorn workers), run them and commit the job's writes
+# together with its "done" status. failures are retried with exponential
+# backoff up to JOB_MAX_ATTEMPTS. a job added in the writing transaction is
+# enqueued exactly once already; a key makes enqueue idempotent for anything
+# else and must never be reused (row ids are, sqlite hands out a deleted max id
+# again)
+JOB_HANDLERS = {}
+
+def job(kind):
+    def decorator(func):
+        JOB_HANDLERS[kind] = func
+        return func
+    return decorator
+
+def enqueue(kind, payload, key=None):
+    if key and db.session.query(Job.id).filter(Job.key == key).first():
+        return
+    try:
+        with db.session.begin_nested():
+            db.session.add(Job(kind=kind, payload=payload, key=key))
+    except IntegrityError:
+        # the same key was enqueued concurrently
+        return
+    db.session.info['jobs_enqueued'] = True
+
+class JobQueue:
+    def __init__(self):
+        self.wakeup = threading.Event()
+        self.stopping = threading.Event()
+        self.lock = threading.Lock()
+        self.threads = []
+        self.pid = None
+        self.purged = 0
+
+    def start(self):
+        # idempotent; also restarts the pool in a forked child, which does not
+        # inherit the parent's threads
+        with self.lock:
+            if self.pid == os.getpid() or not app.config['JOB_WORKERS']:
+                return
+            self.pid = os.getpid()
+            self.stopping.clear()
+            self.threads = [threading.Thread(target=self.work, name=f"job-worker-{i}", daemon=True) for i in range(app.config['JOB_WORKERS'])]
+            for thread in self.threads:
+                thread.start()
+
+    def wake(self):
+        self.start()
+        self.wakeup.set()
+
+    def work(self):
+        while not self.stopping.is_set():
+            try:
+                with app.app_context():
+                    ran = self.run_pending(limit=10)
+                    if time.monotonic() - self.purged > 600:
+                        self.purged = time.monotonic()
+                        self.purge()
+            except Exception:
+                app.logger.exception("job worker failed")
+                ran = 0
+            if not ran:
+                self.wakeup.wait(app.config['JOB_POLL_SECONDS'])
+                self.wakeup.clear()
+
+    def due(self, now):
+        stale = now - timedelta(seconds=app.config['JOB_TIMEOUT'])
+        return ((Job.status == 'pending') & (Job.run_at <= now)) | ((Job.status == 'running') & (Job.claimed_at < stale))
+
+    def claim(self):
+        now = datetime.now()
+        candidates = [row.id for row in db.session.query(Job.id).filter(self.due(now)).order_by(Job.id).limit(5)]
+        for job_id in candidates:
+            claimed = Job.query.filter(Job.id == job_id, self.due(now)).update(
+                {Job.status: 'running', Job.claimed_at: now, Job.attempts: Job.attempts + 1}, synchronize_session=False)
+            db.session.commit()
+            if claimed:
+                return db.session.get(Job, job_id)
+        db.session.rollback()
+        return None
+
+    def run(self, job):
+        job_id, kind, payload = job.id, job.kind, job.payload
+        try:
+            handler = JOB_HANDLERS.get(kind)
+            if handler is None:
+                raise LookupError(f"no handler for job kind {kind!r}")
+            handler(**payload)
+            job.status = 'done'
+            job.last_error = None
+            db.session.commit()
+        except Exception as e:
+            db.session.rollback()
+            job = db.session.get(Job, job_id)
+            job.last_error = f"{type(e).__name__}: {e}"
+            if job.attempts >= app.config['JOB_MAX_ATTEMPTS']:
+                job.status = 'failed'
+                app.logger.error(f"job {job_id} ({kind}) failed for good: {job.last_error}")
+            else:
+                job.status = 'pending'
+                job.run_at = datetime.now() + timedelta(seconds=2 ** job.attempts)
+            db.session.commit()
+
+    def run_pending(self, limit=None):
+        # runs due jobs in the calling thread until none are left or `limit`
+        # ran; returns how many ran. tests call this directly with JOB_WORKERS=0
+        ran = 0
+        while limit is None or ran < limit:
+            job = self.claim()
+            if job is None:
+                break
+            self.run(job)
+            ran += 1
+        return ran
+
+    def purge(self):
+        cutoff = datetime.now() - timedelta(hours=app.config['JOB_KEEP_HOURS'])
+        Job.query.filter(Job.status == 'done', Job.run_at < cutoff).delete(synchronize_session=False)
+        # a worker further behind than this reloads its cache in full
+        cutoff = datetime.now() - timedelta(hours=app.config['CACHE_CHANGES_KEEP_HOURS'])
+        CacheChange.query.filter(CacheChange.created_at < cutoff).delete(synchronize_session=False)
+        db.session.commit()
+
+    def stop(self, drain=True):
+        # for shutdown (gunicorn's worker_exit hook, atexit): runs what is due for
+        # up to JOB_DRAIN_SECONDS, then stops the threads. jobs left over stay
+        # queued for the next worker
+        if self.pid != os.getpid():
+            return
+        deadline = time.monotonic() + app.config['JOB_DRAIN_SECONDS']
+        self.stopping.set()
+        self.wakeup.set()
+        if drain:
+            with app.app_context():
+                while time.monotonic() < deadline and self.run_pending(limit=1):
+                    pass
+        for thread in self.threads:
+            thread.join(max(0, deadline - time.monotonic()))
+        self.threads = []
+        self.pid = None
+
+job_queue = JobQueue()
+atexit.register(job_queue.stop)
+
+@event.listens_for(db.session, 'after_commit')
+def wake_job_workers(session):
+    if session.info.pop('jobs_enqueued', False):
+        job_queue.wake()
+
+
+#spatial index
+# hospitals are bucketed on a uniform grid over their unit-sphere (x, y, z)
+# coordinates; chord length is monotonic in great-circle distance so the grid
+# rings give an exact bound for the k-nearest search
+class HospitalIndex:
+    # id filters up to this size (say a department's on-duty hospitals) are
+    # ranked directly; the rings would rarely fill k from them and end in a scan
+    DIRECT_RANK_IDS = 512
+
+    def __init__(self, cell_km=25):
+        self.cell = cell_km / 6371
+        self.buckets = {}
+        self.points = {}
+        # threaded workers read while write-through updates land
+        self.lock = threading.RLock()
+        # (ids, xyz, availability, lat/lon) numpy arrays for nearest_batch, rebuilt after writes
+        self.arrays = None
+
+    def _xyz(self, lat, lon):
+        lat, lon = math.radians(lat), math.radians(lon)
+        return (math.cos(lat) * math.cos(lon), math.cos(lat) * math.sin(lon), math.sin(lat))
+
+    def _cell(self, xyz):
+        return tuple(int(math.floor(v / self.cell)) for v in xyz)
+
+    def upsert(self, hosp_id, lat, lon, availability):
+        with self.lock:
+            self.arrays = None
+            self.remove(hosp_id)
+            try:
+                lat, lon = float(lat), float(lon)
+            except (TypeError, ValueError):
+                return
+            xyz = self._xyz(lat, lon)
+            cell = self._cell(xyz)
+            self.points[hosp_id] = [lat, lon, xyz, cell, availability]
+            self.buckets.setdefault(cell, set()).add(hosp_id)
+
+    def set_availability(self, hosp_id, availability):
+        with self.lock:
+            if hosp_id in self.points:
+                self.points[hosp_id][4] = availability
+                self.arrays = None
+
+    def remove(self, hosp_id):
+        with self.lock:
+            point = self.points.pop(hosp_id, None)
+            if point:
+                self.arrays = None
+                bucket = self.buckets[point[3]]
+                bucket.discard(hosp_id)
+                if not bucket:
+                    del self.buckets[point[3]]
+
+    def _chord(self, a, b):
+        return math.sqrt((a[0] - b[0])**2 + (a[1] - b[1])**2 + (a[2] - b[2])**2)
+
+    def nearest(self, lat, lon, k=3, ids=None, exclude=()):
+        # returns [(hosp_id, distance_km)] of the k closest hospitals with free
+        # emergency beds, optionally restricted to the hospital ids in `ids`
+        with self.lock:
+            return self._nearest(lat, lon, k, ids, exclude)
+
+    def _nearest(self, lat, lon, k, ids, exclude):
+        lat, lon = float(lat), float(lon)
+        if ids is not None and len(ids) <= self.DIRECT_RANK_IDS:
+            candidates = [h for h in ids if h in self.points and h not in exclude and self.points[h][4] > 0]
+            return self._rank(lat, lon, candidates, k)
+        q = self._xyz(lat, lon)
+        qc = self._cell(q)
+        found = {}
+
+        def consider(hosp_id):
+            if hosp_id in exclude or (ids is not None and hosp_id not in ids):
+                return
+            point = self.points[hosp_id]
+            if point[4] > 0:
+                found[hosp_id] = self._chord(q, point[2])
+
+        r = 0
+        while True:
+            if (2 * r + 1) ** 3 >= len(self.buckets):
+                # the ring is now larger than the occupied grid, finish with a scan
+                for bucket in list(self.buckets.values()):
+                    for hosp_id in bucket:
+                        consider(hosp_id)
+                break
+            for dx in range(-r, r + 1):
+                for dy in range(-r, r + 1):
+                    for dz in range(-r, r + 1):
+                        if max(abs(dx), abs(dy), abs(dz)) != r:
+                            continue
+                        for hosp_id in self.buckets.get((qc[0] + dx, qc[1] + dy, qc[2] + dz), ()):
+                            consider(hosp_id)
+            if len(found) >= k and sorted(found.values())[k - 1] <= r * self.cell:
+                break
+            r += 1
+
+        return self._rank(lat, lon, found, k)
+
+    def _rank(self, lat, lon, candidates, k):
+        ranked = sorted(
+            ((haversine(lat, lon, self.points[h][0], self.points[h][1]), h) for h in candidates)
+        )
+        return [(h, d) for d, h in ranked[:k]]
+
+    def nearest_batch(self, points, k=3, ids=None, exclude=(), chunk_cells=1 << 21):
+        # nearest() for many (lat, lon) points at once. the point x hospital
+        # dot products are computed in numpy chunks to shortlist each point's
+        # k closest by chord, then the shortlist is ranked exactly as nearest()
+        # does, so both always agree. only the array snapshot is taken under
+        # the lock (writers replace it, never change it), so a large batch
+        # doesn't hold up single lookups and write-through
+        if np is None:
+            return [self.nearest(lat, lon, k, ids, exclude) for lat, lon in points]
+        with self.lock:
+            if self.arrays is None:
+                hosp_ids = list(self.points)
+                self.arrays = (
+                    np.array(hosp_ids, dtype=np.int64),
+                    np.array([self.points[h][2] for h in hosp_ids], dtype=np.float64).reshape(-1, 3),
+                    np.array([self.points[h][4] for h in hosp_ids], dtype=np.int64),
+                    np.array([self.points[h][:2] for h in hosp_ids], dtype=np.float64).reshape(-1, 2),
+                )
+            hosp_ids, xyz, beds, coords = self.arrays
+        eligible = beds > 0
+        if ids is not None:
+            eligible &= np.isin(hosp_ids, np.fromiter(ids, dtype=np.int64))
+        if exclude:
+            eligible &= ~np.isin(hosp_ids, np.fromiter(exclude, dtype=np.int64))
+        hosp_ids, xyz, coords = hosp_ids[eligible], xyz[eligible], coords[eligible]
+        if not len(hosp_ids):
+            return [[] for _ in points]
+
+        # bound the distance matrix to chunk_cells entries (16MB of float64)
+        chunk = max(1, chunk_cells // len(hosp_ids))
+        results = []
+        for start in range(0, len(points), chunk):
+            batch = [(float(lat), float(lon)) for lat, lon in points[start:start + chunk]]
+            q = np.array([self._xyz(lat, lon) for lat, lon in batch], dtype=np.float64)
+            # larger dot product = shorter chord = closer
+            dots = q @ xyz.T
+            if len(hosp_ids) > k:
+                kth = -np.partition(-dots, k - 1, axis=1)[:, k - 1]
+                # the margin lets float rounding and ties through to the exact ranking
+                shortlist = dots >= (kth - 1e-9)[:, None]
+            else:
+                shortlist = np.ones(dots.shape, dtype=bool)
+            for (lat, lon), row in zip(batch, shortlist):
+                # the same ranking as _rank(), from the snapshot's coordinates
+                ranked = sorted((haversine(lat, lon, h_lat, h_lon), h) for h, (h_lat, h_lon) in zip(hosp_ids[row].tolist(), coords[row].tolist()))
+                results.append([(h, d) for d, h in ranked[:k]])
+        return results
+
+
+def load_hospital_index():
+    index = HospitalIndex()
+    rows = db.session.query(Hospital.id, Hospital.lat, Hospital.lon, Hospital.cur_emergency_availability).all()
+    for row in rows:
+        index.upsert(row.id, row.lat, row.lon, row.cur_emergency_availability)
+    return index
+
+# the spatial index doubles as the live bed-availability cache
+availability_cache = VersionedCache('availability', load_hospital_index)
+
+def get_hospital_index():
+    return availability_cache.get()
+
+def nearest_hospitals(lat, lon, k=3, ids=None, exclude=()):
+    ranked = get_hospital_index().nearest(lat, lon, k=k, ids=ids, exclude=exclude)
+    if not ranked:
+        return []
+    rows = {h.id: h for h in Hospital.query.filter(Hospital.id.in_([h for h, _ in ranked])).all()}
+    return [rows[h] for h, _ in ranked if h in rows]
+
+
+#pincode lookup
+# pincode -> (lat, lon) centroids, built offline by `flask build-pincodes` and
+# held in memory, so requests without GPS can be placed on the map and ranked
+# by the spatial index like any other
+class PincodeLocator:
+    def __init__(self, rows):
+        self.centroids = {pincode: (lat, lon) for pincode, lat, lon in rows}
+        self.pincodes = sorted(self.centroids)
+
+    def locate(self, pincode):
+        try:
+            pincode = int(pincode)
+        except (TypeError, ValueError):
+            return None
+        if pincode in self.centroids:
+            return self.centroids[pincode]
+        # unknown pincode: use the numerically closest known one in the same
+        # sorting district (first three digits), which is nearby on the ground
+        i = bisect.bisect_left(self.pincodes, pincode)
+        candidates = [p for p in self.pincodes[max(i - 1, 0):i + 1] if p // 1000 == pincode // 1000]
+        if not candidates:
+            return None
+        return self.centroids[min(candidates, key=lambda p: abs(p - pincode))]
+
+pincode_cache = VersionedCache('pincodes', lambda: PincodeLocator(db.session.query(PincodeCentroid.pincode, PincodeCentroid.lat, PincodeCentroid.lon)))
+
+def pincode_centroid(pincode):
+    return pincode_cache.get().locate(pincode)
+
+@job('refresh_pincode')
+def refresh_pincode(pincode):
+    # a registration with GPS in a pincode the table does not know yet gives it
+    # a centroid; known pincodes are left to build-pincodes
+    if db.session.get(PincodeCentroid, pincode):
+        return
+    points = [
+        (lat, lon) for model in (Patient, Hospital)
+        for lat, lon in db.session.query(model.lat, model.lon).filter(model.pincode == pincode, model.lat.isnot(None), model.lon.isnot(None))
+    ]
+    if points:
+        db.session.add(PincodeCentroid(pincode=pincode, lat=sum(p[0] for p in points) / len(points), lon=sum(p[1] for p in points) / len(points)))
+        pincode_cache.bump()
+
+
 #db_models
 class Patient(db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -55,28 +942,57 @@ class Hospital(db.Model):
     name = db.Column(db.String(100), nullable=False)
     address = db.Column(db.String(200), nullable=False)
     telephone = db.Column(db.String(15), nullable=False)
-    pincode = db.Column(db.Integer, nullable=False)
+    pincode = db.Column(db.Integer, nullable=False, index=True)
     lat = db.Column(db.Float, nullable=True)
     lon = db.Column(db.Float, nullable=True)
     emergency_capacity = db.Column(db.Integer, nullable=False)
-    depts = db.Column(JSON, nullable=True)
     cur_emergency_availability = db.Column(db.Integer, nullable=False)
-    cur_emergency_doctors = db.Column(JSON, nullable = True)
+
+class PincodeCentroid(db.Model):
+    pincode = db.Column(db.Integer, primary_key=True)
+    lat = db.Column(db.Float, nullable=False)
+    lon = db.Column(db.Float, nullable=False)
+
+class CacheVersion(db.Model):
+    name = db.Column(db.String(50), primary_key=True)
+    version = db.Column(db.Integer, nullable=False, default=0)
+
+class CacheChange(db.Model):
+    name = db.Column(db.String(50), primary_key=True)
+    version = db.Column(db.Integer, primary_key=True)
+    change = db.Column(JSON, nullable=False)
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.now, index=True)
 
 class Departments(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(100), nullable=False, unique=True)
 
 class Doctor(db.Model):
+    # (hospital_id, department_id) serves view_departments and, through its
+    # leading column, every per-hospital doctor list
+    __table_args__ = (db.Index('ix_doctor_hospital_department', 'hospital_id', 'department_id'),)
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(200), nullable=False)
-    department_id = db.Column(db.Integer, db.ForeignKey('departments.id'), nullable=False)
+    department_id = db.Column(db.Integer, db.ForeignKey('departments.id'), nullable=False, index=True)
     qualification = db.Column(db.String(200), nullable=False)
     experience = db.Column(db.Integer, nullable=False)
     hospital_id = db.Column(db.Integer, db.ForeignKey('hospital.id'), nullable=False)
     slots = db.Column(JSON, nullable=False, default=list)
 
+class HospitalDepartment(db.Model):
+    hospital_id = db.Column(db.Integer, db.ForeignKey('hospital.id'), primary_key=True)
+    department_id = db.Column(db.Integer, db.ForeignKey('departments.id'), primary_key=True)
+
+class EmergencyDoctor(db.Model):
+    # doctors currently on emergency duty at a hospital
+    hospital_id = db.Column(db.Integer, db.ForeignKey('hospital.id'), primary_key=True)
+    doctor_id = db.Column(db.Integer, db.ForeignKey('doctor.id'), primary_key=True, index=True)
+
 class Appointment(db.Model):
+    __table_args__ = (
+        db.Index('ix_appointment_patient_date', 'patient_id', 'appointment_date'),
+        db.Index('ix_appointment_doctor_date', 'doctor_id', 'appointment_date'),
+    )
     id = db.Column(db.Integer, primary_key=True)
     patient_id = db.Column(db.Integer, db.ForeignKey('patient.id'), nullable=False)
     fname = db.Column(db.String(100), nullable=False)
@@ -87,7 +1003,18 @@ class Appointment(db.Model):
     appointment_slot = db.Column(db.String(50), nullable=False)
     status = db.Column(db.String(50), nullable=False)
 
+class SlotReservation(db.Model):
+    # one row per booked (doctor, date, slot); the unique constraint is what
+    # makes reservations atomic under concurrent bookings
+    __table_args__ = (db.UniqueConstraint('doctor_id', 'appointment_date', 'appointment_slot'),)
+    id = db.Column(db.Integer, primary_key=True)
+    doctor_id = db.Column(db.Integer, db.ForeignKey('doctor.id'), nullable=False)
+    appointment_date = db.Column(Date, nullable=False)
+    appointment_slot = db.Column(db.String(50), nullable=False)
+    appointment_id = db.Column(db.Integer, db.ForeignKey('appointment.id'), nullable=False, unique=True)
+
 class EmergencyBooking(db.Model):
+    __table_args__ = (db.Index('ix_emergency_booking_hospital_time', 'hospital_id', 'booking_time'),)
     id = db.Column(db.Integer, primary_key=True)
     patient_name = db.Column(db.String(100), nullable=False)
     patient_id = db.Column(db.Integer, nullable=True)
@@ -100,15 +1027,468 @@ class EmergencyBooking(db.Model):
     booking_time = db.Column(db.DateTime, default=datetime.now)
     reason = db.Column(db.String(300), nullable=False)
 
+class AppointmentDaily(db.Model):
+    # appointment counts per hospital, day and doctor, maintained by the booking
+    # routes (see bump_rollup) so analytics read these instead of appointment
+    hospital_id = db.Column(db.Integer, db.ForeignKey('hospital.id'), primary_key=True)
+    day = db.Column(Date, primary_key=True)
+    doctor_id = db.Column(db.Integer, db.ForeignKey('doctor.id'), primary_key=True)
+    department_id = db.Column(db.Integer, db.ForeignKey('departments.id'), nullable=False)
+    total = db.Column(db.Integer, nullable=False, default=0)
+    pending = db.Column(db.Integer, nullable=False, default=0)
+    completed = db.Column(db.Integer, nullable=False, default=0)
+    no_show = db.Column(db.Integer, nullable=False, default=0)
+
+class EmergencyHourly(db.Model):
+    hospital_id = db.Column(db.Integer, db.ForeignKey('hospital.id'), primary_key=True)
+    hour = db.Column(db.DateTime, primary_key=True)
+    bookings = db.Column(db.Integer, nullable=False, default=0)
+
+class Job(db.Model):
+    __table_args__ = (db.Index('ix_job_status_run_at', 'status', 'run_at'),)
+    id = db.Column(db.Integer, primary_key=True)
+    kind = db.Column(db.String(50), nullable=False)
+    payload = db.Column(JSON, nullable=False, default=dict)
+    key = db.Column(db.String(200), unique=True, nullable=True)
+    status = db.Column(db.String(20), nullable=False, default='pending')
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    run_at = db.Column(db.DateTime, nullable=False, default=datetime.now)
+    claimed_at = db.Column(db.DateTime, nullable=True)
+    last_error = db.Column(db.Text, nullable=True)
+
+class SchemaMigration(db.Model):
+    name = db.Column(db.String(100), primary_key=True)
+    applied_at = db.Column(db.DateTime, default=datetime.now)
+
 def init_db(app):
     with app.app_context():
         db.create_all()
+        applied = migrate_db()
         default_departments = ["Cardiology", "Orthopaedics", "Neurology", "Paediatrics", "General Medicine", "Emergency", "Pulmonology", "Gastroenterology", "ENT", "Opthalmology", "Dematology", "Psychiatry"]
         for name in default_departments:
             exists = Departments.query.filter_by(name=name).first()
             if not exists:
                 db.session.add(Departments(name=name))
+        # start every cache's version row at 0, so bump() is always one update
+        known = {row.name for row in db.session.query(CacheVersion.name)}
+        db.session.add_all(CacheVersion(name=cache.name, version=0) for cache in versioned_caches if cache.name not in known)
         db.session.commit()
+        return applied
+
+
+#migrations
+# create_all only creates missing tables, so anything that changes an existing
+# database goes here. migrations run once each, in order, and are recorded in
+# the schema_migration table. that includes an index declared later on an
+# existing table: give it a migration of its own that calls create_indexes
+def create_indexes(*names):
+    indexes = {index.name: index for table in db.metadata.sorted_tables for index in table.indexes}
+    for name in names:
+        indexes[name].create(bind=db.engine, checkfirst=True)
+
+def backfill_slot_reservations():
+    # reserve slots for appointments booked before the slot inventory existed;
+    # where old data already double-booked a slot only the first one is kept
+    reserved = db.session.query(SlotReservation.appointment_id)
+    appts = Appointment.query.filter(Appointment.id.notin_(reserved)).order_by(Appointment.id).all()
+    for appt in appts:
+        try:
+            with db.session.begin_nested():
+                db.session.add(SlotReservation(doctor_id=appt.doctor_id, appointment_date=appt.appointment_date, appointment_slot=appt.appointment_slot, appointment_id=appt.id))
+        except IntegrityError:
+            pass
+    db.session.commit()
+
+def normalize_hospital_json():
+    # moves the legacy hospital.depts and hospital.cur_emergency_doctors JSON
+    # arrays into hospital_department and emergency_doctor. the old columns are
+    # left in place but no longer read or written
+    columns = {col['name'] for col in inspect(db.engine).get_columns('hospital')}
+    if not {'depts', 'cur_emergency_doctors'} <= columns:
+        return
+
+    def ids(value):
+        if isinstance(value, str):
+            value = json.loads(value)
+        result = []
+        for item in value or []:
+            # early department additions stored a one-element row instead of the id
+            if isinstance(item, list):
+                item = item[0] if item else None
+            if item is not None and int(item) not in result:
+                result.append(int(item))
+        return result
+
+    rows = db.session.execute(db.text("SELECT id, depts, cur_emergency_doctors FROM hospital")).all()
+    for hosp_id, depts, emr_docs in rows:
+        for dept_id in ids(depts):
+            db.session.merge(HospitalDepartment(hospital_id=hosp_id, department_id=dept_id))
+        for doc_id in ids(emr_docs):
+            db.session.merge(EmergencyDoctor(hospital_id=hosp_id, doctor_id=doc_id))
+    db.session.commit()
+
+def rebuild_rollups():
+    # recomputes appointment_daily and emergency_hourly from the raw tables;
+    # the incremental updates keep them current after that
+    AppointmentDaily.query.delete()
+    EmergencyHourly.query.delete()
+    # the rebuild counts everything, so queued count jobs must not add it again
+    Job.query.filter(Job.kind.in_(('count_appointment', 'count_emergency_bookings')), Job.status.in_(('pending', 'running'))).update(
+        {Job.status: 'done'}, synchronize_session=False)
+    rows = (
+        db.session.query(
+            Appointment.hospital_id, Appointment.appointment_date, Appointment.doctor_id, Doctor.department_id,
+            func.count(),
+            *(func.sum(case((Appointment.status == status, 1), else_=0)) for status in STATUS_COUNTERS),
+        )
+        .join(Doctor, Doctor.id == Appointment.doctor_id)
+        .group_by(Appointment.hospital_id, Appointment.appointment_date, Appointment.doctor_id, Doctor.department_id)
+    )
+    daily = (
+        dict(zip(('hospital_id', 'day', 'doctor_id', 'department_id', 'total', *STATUS_COUNTERS.values()), row))
+        for row in rows
+    )
+    for batch in batched(daily, 5000):
+        db.session.execute(db.insert(AppointmentDaily), batch)
+
+    # truncating to the hour is not portable SQL, so bookings are counted here
+    hourly = {}
+    for hosp_id, booked_at in db.session.query(EmergencyBooking.hospital_id, EmergencyBooking.booking_time).yield_per(10000):
+        if booked_at:
+            key = (hosp_id, booked_at.replace(minute=0, second=0, microsecond=0))
+            hourly[key] = hourly.get(key, 0) + 1
+    rows = [{'hospital_id': h, 'hour': hour, 'bookings': n} for (h, hour), n in hourly.items()]
+    for batch in batched(rows, 5000):
+        db.session.execute(db.insert(EmergencyHourly), batch)
+    db.session.commit()
+
+MIGRATIONS = [
+    ("0001_backfill_slot_reservations", backfill_slot_reservations),
+    ("0002_hot_lookup_indexes", lambda: create_indexes(
+        'ix_hospital_pincode', 'ix_doctor_hospital_department', 'ix_doctor_department_id',
+        'ix_appointment_patient_date', 'ix_appointment_doctor_date', 'ix_emergency_booking_hospital_time',
+    )),
+    ("0003_normalize_hospital_json", normalize_hospital_json),
+    ("0004_backfill_rollups", rebuild_rollups),
+]
+
+def migrate_db():
+    # returns the names of the migrations applied by this call
+    done = {row.name for row in SchemaMigration.query.all()}
+    applied = []
+    for name, migration in MIGRATIONS:
+        if name in done:
+            continue
+        migration()
+        db.session.add(SchemaMigration(name=name))
+        db.session.commit()
+        app.logger.info("applied migration %s", name)
+        applied.append(name)
+    return applied
+
+@app.cli.command("migrate")
+def migrate_command():
+    for name in init_db(app):
+        click.echo(f"applied migration {name}")
+
+@app.cli.command("rebuild-rollups", help="Recompute the analytics rollups from appointments and emergency bookings.")
+def rebuild_rollups_command():
+    init_db(app)
+    rebuild_rollups()
+    click.echo(f"{AppointmentDaily.query.count()} daily appointment rows, {EmergencyHourly.query.count()} hourly emergency rows")
+
+#rollups
+# counters in appointment_daily and emergency_hourly are adjusted by background
+# jobs that bookings and cancellations enqueue in their own transaction; each
+# job's key makes sure a change is counted once
+STATUS_COUNTERS = {'Pending': 'pending', 'Completed': 'completed', 'No-show': 'no_show'}
+
+def bump_rollup(model, key, deltas, **fields):
+    # adds deltas to the rollup row at key, creating it (with fields) if needed
+    values = {getattr(model, col): getattr(model, col) + n for col, n in deltas.items()}
+    if model.query.filter_by(**key).update(values, synchronize_session=False):
+        return
+    try:
+        with db.session.begin_nested():
+            db.session.add(model(**key, **fields, **deltas))
+    except IntegrityError:
+        # another request created the row first
+        model.query.filter_by(**key).update(values, synchronize_session=False)
+
+@job('count_appointment')
+def count_appointment(hospital_id, doctor_id, day, status, sign):
+    deltas = {'total': sign}
+    if status in STATUS_COUNTERS:
+        deltas[STATUS_COUNTERS[status]] = sign
+    department_id = db.session.query(Doctor.department_id).filter(Doctor.id == doctor_id).scalar()
+    bump_rollup(AppointmentDaily, {'hospital_id': hospital_id, 'day': date.fromisoformat(day), 'doctor_id': doctor_id}, deltas, department_id=department_id)
+
+def enqueue_appointment_count(appt, sign):
+    payload = {'hospital_id': int(appt.hospital_id), 'doctor_id': int(appt.doctor_id), 'day': appt.appointment_date.isoformat(), 'status': appt.status, 'sign': sign}
+    enqueue('count_appointment', payload)
+
+@job('count_emergency_bookings')
+def count_emergency_bookings(bookings):
+    # bookings: [[hospital_id, booking time as ISO string], ...]
+    hourly = {}
+    for hosp_id, booked_at in bookings:
+        key = (hosp_id, datetime.fromisoformat(booked_at).replace(minute=0, second=0, microsecond=0))
+        hourly[key] = hourly.get(key, 0) + 1
+    for (hosp_id, hour), n in sorted(hourly.items()):
+        bump_rollup(EmergencyHourly, {'hospital_id': hosp_id, 'hour': hour}, {'bookings': n})
+
+def free_slots(doctor, day):
+    booked = {
+        row.appointment_slot for row in
+        db.session.query(SlotReservation.appointment_slot).filter(SlotReservation.doctor_id == doctor.id, SlotReservation.appointment_date == day)
+    }
+    return [slot for slot in doctor.slots if slot not in booked]
+
+def slot_taken(error):
+    # whether an IntegrityError is the (doctor, date, slot) unique constraint;
+    # sqlite lists the columns in its message, postgres in the DETAIL line
+    message = str(error.orig)
+    return ("UNIQUE constraint failed: slot_reservation.doctor_id, slot_reservation.appointment_date, slot_reservation.appointment_slot" in message
+            or "Key (doctor_id, appointment_date, appointment_slot)=" in message)
+
+def reserve_appointment(appt):
+    # inserts the appointment together with its slot reservation, returns False
+    # if the slot was taken first. any other integrity error (a missing doctor,
+    # a null field) is a real error and raises
+    db.session.add(appt)
+    db.session.flush()
+    db.session.add(SlotReservation(doctor_id=appt.doctor_id, appointment_date=appt.appointment_date, appointment_slot=appt.appointment_slot, appointment_id=appt.id))
+    try:
+        db.session.flush()
+    except IntegrityError as e:
+        db.session.rollback()
+        if not slot_taken(e):
+            raise
+        return False
+    enqueue_appointment_count(appt, 1)
+    db.session.commit()
+    return True
+
+
+#on-duty department index
+# dept_id -> {hospital_id: number of on-duty emergency doctors in that department}
+class EmergencyDepartmentIndex:
+    def __init__(self):
+        self.by_dept = {}
+        self.doctor_dept = {}
+        # (hospital_id, doctor_id) pairs counted, so replaying a change is harmless
+        self.duty = set()
+
+    def add_doctor(self, doc_id, dept_id):
+        self.doctor_dept[doc_id] = dept_id
+
+    def on_duty(self, hosp_id, doc_id):
+        dept_id = self.doctor_dept.get(doc_id)
+        if dept_id is None or (hosp_id, doc_id) in self.duty:
+            return
+        self.duty.add((hosp_id, doc_id))
+        hosps = self.by_dept.setdefault(dept_id, {})
+        hosps[hosp_id] = hosps.get(hosp_id, 0) + 1
+
+    def off_duty(self, hosp_id, doc_id):
+        if (hosp_id, doc_id) not in self.duty:
+            return
+        self.duty.discard((hosp_id, doc_id))
+        hosps = self.by_dept.get(self.doctor_dept.get(doc_id), {})
+        if hosps.get(hosp_id, 0) > 1:
+            hosps[hosp_id] -= 1
+        else:
+            hosps.pop(hosp_id, None)
+
+    def hospitals_for(self, dept_id):
+        return set(self.by_dept.get(dept_id, ()))
+
+
+def load_emergency_index():
+    index = EmergencyDepartmentIndex()
+    for row in db.session.query(Doctor.id, Doctor.department_id).all():
+        index.add_doctor(row.id, row.department_id)
+    for row in db.session.query(EmergencyDoctor.hospital_id, EmergencyDoctor.doctor_id).all():
+        index.on_duty(row.hospital_id, row.doctor_id)
+    return index
+
+emergency_cache = VersionedCache('emergency_doctors', load_emergency_index)
+
+def get_emergency_index():
+    return emergency_cache.get()
+
+
+#doctor directory
+# doctors, departments and hospital names held per worker for the lookups the
+# hospital pages and /get-doctors keep repeating: doctors by department, doctors
+# by hospital, a department's name or id. records use __slots__ and share
+# interned strings (qualifications and slot ranges repeat a lot), the indexes
+# hold the records themselves in id order. writers bump directory_cache and add
+# their change locally, other workers reload on the new version
+class DirectoryEntry:
+    __slots__ = ('id', 'name')
+
+    def __init__(self, id, name):
+        self.id = id
+        self.name = name
+
+
+class DoctorEntry:
+    __slots__ = ('id', 'name', 'department_id', 'hospital_id', 'qualification', 'experience', 'slots')
+
+    def __init__(self, id, name, department_id, hospital_id, qualification, experience, slots):
+        self.id = id
+        self.name = name
+        self.department_id = department_id
+        self.hospital_id = hospital_id
+        self.qualification = sys.intern(qualification)
+        self.experience = experience
+        self.slots = tuple(sys.intern(str(slot)) for slot in slots or ())
+
+
+class DoctorDirectory:
+    def __init__(self):
+        self.doctors = {}
+        self.departments = {}
+        self.department_ids = {}
+        self.hospitals = {}
+        self.by_dept = {}
+        self.by_hospital = {}
+        self.hospital_depts = {}
+        # dept_id -> (tag, json body, etag) of /get-doctors, built on first
+        # request. readers build without the cache lock, so a payload is only
+        # served while its tag (taken before building) is still current
+        self.payloads = {}
+        self.payload_versions = {}
+        self.payload_epoch = 0
+
+    def add_hospital(self, hosp_id, name):
+        self.hospitals[hosp_id] = DirectoryEntry(hosp_id, name)
+        return self.hospitals[hosp_id]
+
+    def add_department(self, dept_id, name, hosp_id=None):
+        if dept_id not in self.departments:
+            self.departments[dept_id] = DirectoryEntry(dept_id, name)
+            self.department_ids[name] = dept_id
+        if hosp_id is not None:
+            self.hospital_depts.setdefault(hosp_id, set()).add(dept_id)
+
+    def add_doctor(self, *fields):
+        # replaces the doctor if already present, so replaying a change is harmless
+        doctor = DoctorEntry(*fields)
+        old = self.doctors.get(doctor.id)
+        if old is not None:
+            self._drop(self.by_dept[old.department_id], old)
+            self._drop(self.by_hospital[old.hospital_id], old)
+        self.doctors[doctor.id] = doctor
+        self._place(self.by_dept.setdefault(doctor.department_id, []), doctor)
+        self._place(self.by_hospital.setdefault(doctor.hospital_id, []), doctor)
+        # after the lists change, so a payload built from the old ones is stale
+        if old is not None:
+            self.drop_payload(old.department_id)
+        self.drop_payload(doctor.department_id)
+
+    def payload_tag(self, dept_id):
+        return (self.payload_epoch, self.payload_versions.get(dept_id, 0))
+
+    def drop_payload(self, dept_id):
+        self.payload_versions[dept_id] = self.payload_versions.get(dept_id, 0) + 1
+        self.payloads.pop(dept_id, None)
+
+    def drop_payloads(self):
+        self.payload_epoch += 1
+        self.payloads.clear()
+
+    @staticmethod
+    def _place(doctors, doctor):
+        # the lists stay in id order; a new doctor has the highest id and appends
+        if not doctors or doctors[-1].id < doctor.id:
+            doctors.append(doctor)
+        else:
+            bisect.insort(doctors, doctor, key=lambda doc: doc.id)
+
+    @staticmethod
+    def _drop(doctors, doctor):
+        i = bisect.bisect_left(doctors, doctor.id, key=lambda doc: doc.id)
+        if i < len(doctors) and doctors[i] is doctor:
+            del doctors[i]
+
+    def department_name(self, dept_id):
+        dept = self.departments.get(dept_id)
+        return dept.name if dept else None
+
+    def departments_of(self, hosp_id):
+        return [self.departments[dept_id] for dept_id in sorted(self.hospital_depts.get(hosp_id, ()))]
+
+    def doctors_in(self, dept_id, hosp_id=None):
+        if hosp_id is None:
+            return self.by_dept.get(dept_id, [])
+        return [doc for doc in self.by_hospital.get(hosp_id, ()) if doc.department_id == dept_id]
+
+
+def load_doctor_directory():
+    directory = DoctorDirectory()
+    for row in db.session.query(Hospital.id, Hospital.name).all():
+        directory.add_hospital(row.id, row.name)
+    rows = (
+        db.session.query(Departments.id, Departments.name, HospitalDepartment.hospital_id)
+        .outerjoin(HospitalDepartment, HospitalDepartment.department_id == Departments.id)
+        .all()
+    )
+    for row in rows:
+        directory.add_department(row.id, row.name, row.hospital_id)
+    rows = (
+        db.session.query(Doctor.id, Doctor.name, Doctor.department_id, Doctor.hospital_id, Doctor.qualification, Doctor.experience, Doctor.slots)
+        .order_by(Doctor.id)
+        .all()
+    )
+    for row in rows:
+        directory.add_doctor(*row)
+    return directory
+
+def refresh_doctor_directory(directory, changes):
+    # changes: [{"hospitals": [ids], "departments": [ids], "links": [[hospital_id,
+    # department_id]], "doctors": [ids]}, ...]; the rows are re-read by id
+    ids = {'hospitals': set(), 'departments': set(), 'doctors': set()}
+    links = set()
+    for change in changes:
+        for kind in ids:
+            ids[kind].update(change.get(kind, ()))
+        links.update(tuple(link) for link in change.get('links', ()))
+    ids['departments'].update(dept_id for hosp_id, dept_id in links)
+    for chunk in batched(sorted(ids['hospitals']), 500):
+        for row in db.session.query(Hospital.id, Hospital.name).filter(Hospital.id.in_(chunk)):
+            directory.add_hospital(row.id, row.name)
+    if ids['hospitals']:
+        # the /get-doctors payloads carry hospital names
+        directory.drop_payloads()
+    for chunk in batched(sorted(ids['departments']), 500):
+        for row in db.session.query(Departments.id, Departments.name).filter(Departments.id.in_(chunk)):
+            directory.add_department(row.id, row.name)
+    for hosp_id, dept_id in links:
+        if dept_id in directory.departments:
+            directory.add_department(dept_id, directory.department_name(dept_id), hosp_id)
+    for chunk in batched(sorted(ids['doctors']), 500):
+        rows = db.session.query(Doctor.id, Doctor.name, Doctor.department_id, Doctor.hospital_id, Doctor.qualification, Doctor.experience, Doctor.slots).filter(Doctor.id.in_(chunk))
+        for row in rows:
+            directory.add_doctor(*row)
+
+directory_cache = VersionedCache('doctor_directory', load_doctor_directory, refresh_doctor_directory)
+
+def get_doctor_directory():
+    return directory_cache.get()
+
+def directory_hospital(hosp_id):
+    # hospitals registered after the directory loaded are filled in on first use
+    directory = get_doctor_directory()
+    hospital = directory.hospitals.get(hosp_id)
+    if hospital is None:
+        with cache_fill():
+            row = db.session.query(Hospital.id, Hospital.name).filter(Hospital.id == hosp_id).first()
+        if row is None:
+            return None
+        hospital = directory.add_hospital(row.id, row.name)
+    return hospital
 
 
 DEPARTMENT_RULES = {
@@ -140,26 +1520,76 @@ DEPARTMENT_RULES = {
         "anxiety", "panic", "depression", "stress", "hallucination"
     ]
 }
-def classify_emergency(text):
-    text = text.lower()
-    scores = {}
-    for dept, keywords in DEPARTMENT_RULES.items():
-        score = sum(1 for kw in keywords if re.search(rf"\b{kw}\b", text))
-        if score > 0:
-            scores[dept] = score
-    if not scores:
+# all keywords are matched in one pass with a single compiled alternation.
+# the lookahead lets keywords starting at different offsets overlap ("red eye"
+# and "eye"), and keywords that are word-bounded prefixes of a longer match at
+# the same offset are implied by it, so every keyword is counted exactly as a
+# separate re.search(rf"\b{kw}\b") would count it
+def compile_department_rules(rules):
+    keyword_depts = {}
+    for dept, keywords in rules.items():
+        for kw in keywords:
+            keyword_depts.setdefault(kw, []).append(dept)
+    ordered = sorted(keyword_depts, key=len, reverse=True)
+    pattern = re.compile(r"\b(?=(" + "|".join(re.escape(kw) for kw in ordered) + r")\b)")
+    implied = {
+        kw: [other for other in ordered if other != kw and re.match(rf"\b{re.escape(other)}\b", kw)]
+        for kw in ordered
+    }
+    return pattern, keyword_depts, implied, list(rules)
+
+department_matcher = compile_department_rules(DEPARTMENT_RULES)
+
+def classify_emergency(text, matcher=None):
+    pattern, keyword_depts, implied, depts = matcher or department_matcher
+    found = set()
+    for m in pattern.finditer(text.lower()):
+        kw = m.group(1)
+        found.add(kw)
+        found.update(implied[kw])
+    return score_departments(found, keyword_depts, depts)
+
+def score_departments(found, keyword_depts, depts):
+    if not found:
         return "General Medicine", 0.55
+    counts = {}
+    for kw in found:
+        for dept in keyword_depts[kw]:
+            counts[dept] = counts.get(dept, 0) + 1
+    scores = {dept: counts[dept] for dept in depts if dept in counts}
     best_dept = max(scores, key=scores.get)
     confidence = min(0.95, 0.6 + scores[best_dept] * 0.1)
     return best_dept, round(confidence, 2)
 
+def classify_emergency_batch(texts, matcher=None):
+    # classify_emergency for many texts. a batch repeats itself: identical
+    # texts are matched once, and texts that hit the same keywords share one
+    # scoring, which costs as much as the match itself
+    pattern, keyword_depts, implied, depts = matcher or department_matcher
+    by_text = {}
+    by_keywords = {}
+    for text in texts:
+        if text in by_text:
+            continue
+        found = set()
+        for kw in pattern.findall(text.lower()):
+            found.add(kw)
+            found.update(implied[kw])
+        found = frozenset(found)
+        if found not in by_keywords:
+            by_keywords[found] = score_departments(found, keyword_depts, depts)
+        by_text[text] = by_keywords[found]
+    return [by_text[text] for text in texts]
+
 
 #routes
 @app.route('/')
+@cached_page('static', cache_control='public, max-age=300')
 def home():
     return render_template('home.html')
 
 @app.route('/about')
+@cached_page('static', cache_control='public, max-age=300')
 def about():
     return render_template('about_us.html')
 
@@ -194,7 +1624,7 @@ def patient_verify_login():
     token = request.json.get("token")
 
     try:
-        decoded = auth.verify_id_token(token)
+        decoded = get_token_verifier().verify(token)
         email = decoded["email"]
         user = db.session.query(Patient.id).filter(Patient.email == email).first()
         if not user:
@@ -220,10 +1650,56 @@ def patient_dashboard():
     else:
         user_id = request.args.get('user_id')
     user = Patient.query.get(user_id)
-    u_app = db.session.query(Appointment.id.label('id'), Appointment.appointment_date.label('date'), Appointment.appointment_slot.label('slot'), Doctor.name.label('doctor_name'), Hospital.name.label('hospital_name')).join(Doctor, Appointment.doctor_id == Doctor.id).join(Hospital, Appointment.hospital_id == Hospital.id).filter(Appointment.patient_id == user.id, Appointment.appointment_date >= today).all()
-    p_app = db.session.query(Appointment.id.label('id'), Appointment.appointment_date.label('date'), Appointment.appointment_slot.label('slot'), Doctor.name.label('doctor_name'), Hospital.name.label('hospital_name')).join(Doctor, Appointment.doctor_id == Doctor.id).join(Hospital, Appointment.hospital_id == Hospital.id).filter(Appointment.patient_id == user.id, Appointment.appointment_date < today).all()
+    u_app = appointment_rows().filter(Appointment.patient_id == user.id, Appointment.appointment_date >= date.today()).all()
+    p_app, next_page = appointment_history(user.id)
     session['patient_id'] = user.id
-    return render_template('patient_dashboard.html', user=user, u_app=u_app, p_app=p_app)
+    return render_template('patient_dashboard.html', user=user, u_app=u_app, p_app=p_app, next_page=next_page, p_count=count_past_appointments(user.id))
+
+HISTORY_PAGE_SIZE = 20
+
+def appointment_rows():
+    return db.session.query(Appointment.id.label('id'), Appointment.appointment_date.label('date'), Appointment.appointment_slot.label('slot'), Doctor.name.label('doctor_name'), Hospital.name.label('hospital_name')).join(Doctor, Appointment.doctor_id == Doctor.id).join(Hospital, Appointment.hospital_id == Hospital.id)
+
+def appointment_history(patient_id, before=None, limit=HISTORY_PAGE_SIZE):
+    # past appointments, newest first, paged on (appointment_date, id) so each
+    # page is a range read on ix_appointment_patient_date however deep it is
+    query = appointment_rows().filter(Appointment.patient_id == patient_id, Appointment.appointment_date < date.today())
+    if before:
+        query = query.filter(tuple_(Appointment.appointment_date, Appointment.id) < tuple_(*before))
+    rows = query.order_by(Appointment.appointment_date.desc(), Appointment.id.desc()).limit(limit + 1).all()
+    next_page = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_page = {"before_date": rows[-1].date.isoformat(), "before_id": rows[-1].id}
+    return rows, next_page
+
+def count_past_appointments(patient_id):
+    return db.session.query(func.count(Appointment.id)).filter(Appointment.patient_id == patient_id, Appointment.appointment_date < date.today()).scalar()
+
+@app.route('/patient/appointments')
+def patient_appointments():
+    patient_id = session.get('patient_id') or request.args.get('user_id', type=int)
+    if not patient_id:
+        return jsonify({"status": "unauthorized"}), 401
+    before = None
+    if request.args.get('before_date') or request.args.get('before_id'):
+        try:
+            before = (date.fromisoformat(request.args.get('before_date', '')), int(request.args.get('before_id', '')))
+        except ValueError:
+            return jsonify({"error": "before_date must be YYYY-MM-DD and before_id an integer, both given"}), 400
+    limit = request.args.get('limit', HISTORY_PAGE_SIZE, type=int)
+    if limit < 1:
+        return jsonify({"error": "limit must be a positive integer"}), 400
+    limit = min(limit, 100)
+    rows, next_page = appointment_history(patient_id, before, limit)
+    return jsonify({
+        "appointments": [
+            {"id": r.id, "date": r.date.isoformat(), "slot": r.slot, "doctor_name": r.doctor_name, "hospital_name": r.hospital_name}
+            for r in rows
+        ],
+        "next": next_page,
+        "total": count_past_appointments(patient_id) if not before else None,
+    })
 
 @app.route('/patient/logout')
 def logout():
@@ -263,6 +1739,8 @@ def new_patient():
 
         new_user = Patient(email=email, password=password, fname=fname, lname=lname, phone=phone, pincode=pincode, dob=dob, lat=lat, lon=lon)
         db.session.add(new_user)
+        if lat and lon and str(pincode).isdigit():
+            enqueue('refresh_pincode', {'pincode': int(pincode)})
         db.session.commit()
 
         return render_template(
@@ -274,22 +1752,40 @@ def new_patient():
     return render_template('patient_registration.html', email=user_email)
 
 @app.route('/patient/new-appointment', methods=['GET', 'POST'])
+@cached_page('departments')
 def patient_new_appointment():
     depts = Departments.query.all()
     return render_template('patient_new_appointment.html', depts=depts)
 
+def department_doctors(dept_id):
+    directory = get_doctor_directory()
+    tag = directory.payload_tag(dept_id)
+    payload = directory.payloads.get(dept_id)
+    if payload is None or payload[0] != tag:
+        docs = [(doc, directory_hospital(doc.hospital_id)) for doc in list(directory.doctors_in(dept_id))]
+        body = app.json.dumps([{"id": f"{doc.id},{doc.hospital_id}", "name": doc.name, "hname": hospital.name} for doc, hospital in docs if hospital])
+        # a change while building bumped the tag, and the next request rebuilds
+        payload = directory.payloads[dept_id] = (tag, body, hashlib.md5(body.encode()).hexdigest())
+    return payload[1:]
+
 @app.route('/get-doctors/<int:dept_id>')
 def get_doctors(dept_id):
-    doctors = Doctor.query.filter_by(department_id=dept_id).all()
-    hospitals = Hospital.query.all()
-    return jsonify([
-        {"id": f"{d.id},{h.id}", "name": d.name, "hname" : h.name}
-        for d in doctors for h in hospitals if d.hospital_id == h.id
-    ])
+    body, etag = department_doctors(dept_id)
+    response = app.response_class(body + "\n", mimetype='application/json')
+    response.set_etag(etag)
+    response.cache_control.no_cache = True
+    return response.make_conditional(request)
 
 @app.route('/get-slots/<doctor_id>')
 def get_slots(doctor_id):
     doctor = Doctor.query.get_or_404(doctor_id.split(',')[0])
+    day = request.args.get('date')
+    if day:
+        try:
+            day = datetime.strptime(day, "%Y-%m-%d").date()
+        except ValueError:
+            return jsonify({"error": "date must be YYYY-MM-DD"}), 400
+        return jsonify(free_slots(doctor, day))
     return jsonify(doctor.slots)
 
 
@@ -304,8 +1800,12 @@ def confirm_appointment():
     slot = request.form.get('slot')
 
     new_app = Appointment(fname=fname, lname=lname, appointment_date=date, patient_id=patient_id, doctor_id=doct_id, hospital_id=hosp_id, appointment_slot=slot, status="Pending")
-    db.session.add(new_app)
-    db.session.commit()
+    if not reserve_appointment(new_app):
+        return render_template(
+            'alert.html',
+            message="This slot has already been booked! Please choose another slot.",
+            redirect_url="/patient/new-appointment"
+        )
 
     return render_template(
         'alert.html',
@@ -319,6 +1819,8 @@ def cancel_appointment():
     app_id = request.args.get('app_id')
     appt = Appointment.query.get(app_id)
     if appt:
+        SlotReservation.query.filter_by(appointment_id=appt.id).delete()
+        enqueue_appointment_count(appt, -1)
         db.session.delete(appt)
         db.session.commit()
         return render_template('alert.html', message = "Your appointment is deleted successfully", redirect_url = f"/patient/dashboard?user_id={ user_id }")
@@ -326,6 +1828,7 @@ def cancel_appointment():
 
 
 @app.route('/hospital/login', methods=['GET', 'POST'])
+@query_budget(1)
 def hospital_login():
     if request.method == "POST":
         email = request.form.get('email')
@@ -355,7 +1858,7 @@ def hospital_verify_login():
     token = request.json.get("token")
 
     try:
-        decoded = auth.verify_id_token(token)
+        decoded = get_token_verifier().verify(token)
         email = decoded["email"]
         user = db.session.query(Hospital.id).filter(Hospital.email == email).first()
         if not user:
@@ -369,6 +1872,7 @@ def hospital_verify_login():
         return jsonify({"status": "invalid"}), 401
 
 @app.route('/hospital/dashboard')
+@query_budget(3)
 def hospital_dashboard():
     if 'user_id' not in session and not request.args.get('user_id'):
         return render_template(
@@ -381,30 +1885,16 @@ def hospital_dashboard():
     else:
         user_id = request.args.get('user_id')
     user = Hospital.query.filter_by(id=user_id).first()
-    depts = []
-    if user.depts:
-        dept_ids = [dept_id for dept_id in user.depts]
-        for id in dept_ids:
-            dept = Departments.query.get(int(id))
-            if dept:
-                depts.append(dept.name)
+    depts = sorted(dept.name for dept in get_doctor_directory().departments_of(user.id))
     session['hospital_id'] = user.id
-    
-    doctors = (
-        db.session.query(
-            Doctor.name,
-            Departments.name.label("dept_name")
-        )
-        .join(Departments, Doctor.department_id == Departments.id)
-        .filter(Doctor.hospital_id == user.id)
-        .all()
-    )
-    
+
+    staff = hospital_doctors(user.id)
+    doctors = [doc for doc in staff if doc.hospital_id == user.id]
+    emr_docs = [doc for doc in staff if doc.on_duty]
+
     total_beds = user.emergency_capacity
     available_beds = user.cur_emergency_availability
     occupied_beds = total_beds - available_beds
-    emr_list = user.cur_emergency_doctors
-    emr_docs = db.session.query(Doctor.id.label('id'), Doctor.name.label('name'), Departments.name.label('dept')).join(Departments, Doctor.department_id == Departments.id).filter(Doctor.id.in_(emr_list)).all()
 
     return render_template(
         'hospital_dashboard.html',
@@ -417,33 +1907,104 @@ def hospital_dashboard():
         emr_docs=emr_docs
     )
 
+StaffRow = namedtuple('StaffRow', 'id name hospital_id dept dept_name on_duty')
+
+def hospital_doctors(hosp_id):
+    # the hospital's own doctors plus anyone on emergency duty there; only the
+    # duty roster comes from the database, the rest from the doctor directory
+    directory = get_doctor_directory()
+    on_duty = {row.doctor_id for row in db.session.query(EmergencyDoctor.doctor_id).filter(EmergencyDoctor.hospital_id == hosp_id)}
+    doctor_ids = {doc.id for doc in directory.by_hospital.get(hosp_id, ())} | on_duty
+    staff = []
+    for doc_id in sorted(doctor_ids):
+        doc = directory.doctors.get(doc_id)
+        if doc:
+            dept = directory.department_name(doc.department_id)
+            staff.append(StaffRow(doc.id, doc.name, doc.hospital_id, dept, dept, doc_id in on_duty))
+    return staff
+
+@app.route('/hospital/analytics')
+@query_budget(4)
+def hospital_analytics():
+    # appointment load and emergency intake for ?start=&end= (ISO dates, default
+    # the last and next 30 days), read from the rollup tables
+    user_id = session.get('user_id') or request.args.get('user_id', type=int)
+    if not user_id:
+        return jsonify({"error": "not logged in"}), 401
+    try:
+        start = date.fromisoformat(request.args.get('start') or (date.today() - timedelta(days=30)).isoformat())
+        end = date.fromisoformat(request.args.get('end') or (date.today() + timedelta(days=30)).isoformat())
+    except ValueError:
+        return jsonify({"error": "start and end must be YYYY-MM-DD"}), 400
+
+    rows = (
+        db.session.query(AppointmentDaily, Doctor.name, Departments.name)
+        .join(Doctor, Doctor.id == AppointmentDaily.doctor_id)
+        .join(Departments, Departments.id == AppointmentDaily.department_id)
+        .filter(AppointmentDaily.hospital_id == user_id, AppointmentDaily.day >= start, AppointmentDaily.day <= end)
+        .all()
+    )
+    hourly = (
+        db.session.query(EmergencyHourly.hour, EmergencyHourly.bookings)
+        .filter(EmergencyHourly.hospital_id == user_id, EmergencyHourly.hour >= datetime.combine(start, datetime.min.time()), EmergencyHourly.hour < datetime.combine(end + timedelta(days=1), datetime.min.time()))
+        .order_by(EmergencyHourly.hour)
+        .all()
+    )
+
+    def totals(groups, key):
+        result = []
+        for name, counts in sorted(groups.items()):
+            total = counts['total']
+            result.append(dict(counts, **{key: name}, pending_ratio=round(counts['pending'] / total, 3) if total else 0, no_show_ratio=round(counts['no_show'] / total, 3) if total else 0))
+        return result
+
+    by_day, by_dept, by_doctor = {}, {}, {}
+    for row, doctor, dept in rows:
+        for groups, name in ((by_day, row.day.isoformat()), (by_dept, dept), (by_doctor, (row.doctor_id, doctor))):
+            counts = groups.setdefault(name, {'total': 0, 'pending': 0, 'completed': 0, 'no_show': 0})
+            for col in counts:
+                counts[col] += getattr(row, col)
+
+    return jsonify({
+        "start": start.isoformat(),
+        "end": end.isoformat(),
+        "days": totals(by_day, 'day'),
+        "departments": totals(by_dept, 'department'),
+        "doctors": [dict(d, doctor_id=d['doctor'][0], doctor=d['doctor'][1]) for d in totals(by_doctor, 'doctor')],
+        "emergency_hourly": [{"hour": hour.isoformat(), "bookings": n} for hour, n in hourly],
+    })
+
 @app.route('/hospital/dashboard/emergency-doctors')
+@query_budget(2)
 def emergency_doctors():
-    user_id = request.args.get('user_id')
-    user = Hospital.query.filter_by(id=user_id).first()
-    emr_list = user.cur_emergency_doctors
-    emr_docs = db.session.query(Doctor.id.label('id'), Doctor.name.label('name'), Departments.name.label('dept')).join(Departments, Doctor.department_id == Departments.id).filter(Doctor.id.in_(emr_list)).all()
-    other_docs = db.session.query(Doctor.id.label('id'), Doctor.name.label('name'), Departments.name.label('dept')).join(Departments, Doctor.department_id == Departments.id).filter(Doctor.id.notin_(emr_list), Doctor.hospital_id == user_id).all()
+    user_id = request.args.get('user_id', type=int)
+    user = directory_hospital(user_id)
+    staff = hospital_doctors(user.id)
+    emr_docs = [doc for doc in staff if doc.on_duty]
+    other_docs = [doc for doc in staff if not doc.on_duty]
     return render_template('emergency_doctors.html', user=user, emr_docs=emr_docs, other_docs=other_docs)
 
 @app.route('/hospital/dashboard/emergency/add-doctor')
+@query_budget(6)
 def add_doctor():
     user_id = request.args.get('user_id', type=int)
-    user = Hospital.query.filter_by(id=user_id).first()
     doc_id = request.args.get('doc_id', type=int)
-    user.cur_emergency_doctors.append(doc_id)
-    flag_modified(user, "cur_emergency_doctors")
-    db.session.commit()
+    if not db.session.get(EmergencyDoctor, (user_id, doc_id)):
+        db.session.add(EmergencyDoctor(hospital_id=user_id, doctor_id=doc_id))
+        version = emergency_cache.bump()
+        db.session.commit()
+        emergency_cache.apply(version, lambda index: index.on_duty(user_id, doc_id))
     return render_template('alert.html', message = 'Doctor added successfully', redirect_url = f"/hospital/dashboard/emergency-doctors?user_id={user_id}")
 
 @app.route('/hospital/dashboard/emergency/remove-doctor')
+@query_budget(5)
 def remove_doctor():
     user_id = request.args.get('user_id', type=int)
-    user = Hospital.query.filter_by(id=user_id).first()
     doc_id = request.args.get('doc_id', type=int)
-    user.cur_emergency_doctors.remove(doc_id)
-    flag_modified(user, "cur_emergency_doctors")
-    db.session.commit()
+    if EmergencyDoctor.query.filter_by(hospital_id=user_id, doctor_id=doc_id).delete():
+        version = emergency_cache.bump()
+        db.session.commit()
+        emergency_cache.apply(version, lambda index: index.off_duty(user_id, doc_id))
     return render_template('alert.html', message = 'Doctor removed successfully', redirect_url = f"/hospital/dashboard/emergency-doctors?user_id={user_id}")
 
 @app.route('/hospital/logout')
@@ -456,6 +2017,7 @@ def hospital_logout():
     )
 
 @app.route('/hospital/new-doctor', methods=['GET', 'POST'])
+@query_budget(8)
 def hospital_new_doctor():
     if 'hospital_id' not in session:
         return redirect('/hospital/login')
@@ -471,7 +2033,14 @@ def hospital_new_doctor():
 
         new_doctor = Doctor(name=name, department_id=department, qualification=qualification, experience=experience, hospital_id=hospital_id, slots=slots)
         db.session.add(new_doctor)
+        db.session.flush()
+        fields = (new_doctor.id, name, int(department), hospital_id, qualification, int(experience), slots)
+        version = emergency_cache.bump()
+        directory_cache.record(doctors=[fields[0]])
+        directory_version = directory_cache.bump()
         db.session.commit()
+        emergency_cache.apply(version, lambda index: index.add_doctor(fields[0], fields[2]))
+        directory_cache.apply(directory_version, lambda directory: directory.add_doctor(*fields))
 
         session['user_id'] = hospital_id
         return render_template(
@@ -479,41 +2048,40 @@ def hospital_new_doctor():
             message="Doctor added successfully!",
             redirect_url="/hospital/dashboard?"
         )
-    hos = Hospital.query.filter(Hospital.id==session['hospital_id']).first()
-    hos_depts = hos.depts
-    depts = Departments.query.filter(Departments.id.in_(hos_depts))
+    depts = get_doctor_directory().departments_of(session['hospital_id'])
     return render_template('hospital_new_doctor.html', depts=depts)
 
 @app.route('/hospital/new-department', methods=['GET', 'POST'])
+@query_budget(6)
+@cached_page('static', vary=lambda: '' if 'hospital_id' in session else None, cache_control='private, no-cache')
 def hospital_new_department():
     if 'hospital_id' not in session:
         return redirect('/hospital/login')
     if request.method == "POST":
         name = request.form.get('name')
 
+        hosp_id = session['hospital_id']
         dept = Departments.query.filter_by(name=name).first()
         if dept:
-            dept_id = dept.id
-            hosp = Hospital.query.get(session['hospital_id'])
-            if not hosp.depts:
-                hosp.depts = []
-            if dept_id in hosp.depts:
+            if db.session.get(HospitalDepartment, (hosp_id, dept.id)):
                 return render_template(
                     'alert.html',
                     message="Department already exists in your hospital!",
                     redirect_url="/hospital/dashboard"
                 )
-            hosp.depts.append(dept_id)
-            flag_modified(hosp, "depts")
-            db.session.commit()
         else:
-            new_dept = Departments(name=name)
-            db.session.add(new_dept)
-            db.session.commit()
-            dept_id = db.session.query(Departments.id).filter(Departments.name == name).first()
-            hosp = Hospital.query.get(session['hospital_id'])
-            hosp.depts.append(dept_id)
-            db.session.commit()
+            dept = Departments(name=name)
+            db.session.add(dept)
+            db.session.flush()
+            # the new appointment form lists every department
+            page_cache('departments').bump()
+        db.session.add(HospitalDepartment(hospital_id=hosp_id, department_id=dept.id))
+        dept_id, dept_name = dept.id, dept.name
+        directory_cache.record(departments=[dept_id], links=[[hosp_id, dept_id]])
+        version = directory_cache.bump()
+        db.session.commit()
+        page_cache('departments').clear()
+        directory_cache.apply(version, lambda directory: directory.add_department(dept_id, dept_name, hosp_id))
 
         return render_template(
             'alert.html',
@@ -523,14 +2091,19 @@ def hospital_new_department():
     return render_template('hospital_new_department.html')
 
 @app.route('/hospital/update-beds/occupied',methods=['GET','POST'])
+@query_budget(6)
+@cached_page('static', vary=lambda: '' if 'user_id' in session else None, cache_control='private, no-cache')
 def update_occupied_beds():
     if 'user_id' not in session:
         return redirect('/hospital/login')
     hospital=Hospital.query.get(session['user_id'])
     if request.method=='POST':
         occupied=int(request.form.get('occupied'))
-        hospital.cur_emergency_availability=hospital.emergency_capacity-occupied
+        available=hospital.emergency_capacity-occupied
+        hospital.cur_emergency_availability=available
+        version = availability_cache.bump()
         db.session.commit()
+        availability_cache.apply(version, lambda index: index.set_availability(hospital.id, available))
         return redirect('/hospital/dashboard')
     return render_template(
         'emergency_occupied_beds.html', 
@@ -538,6 +2111,8 @@ def update_occupied_beds():
     )
     
 @app.route('/hospital/update-beds/total',methods=['GET','POST'])
+@query_budget(2)
+@cached_page('static', vary=lambda: '' if 'user_id' in session else None, cache_control='private, no-cache')
 def update_total_beds():
     if 'user_id' not in session:
         return redirect('/hospital/login')
@@ -553,15 +2128,19 @@ def update_total_beds():
     )
 
 @app.route('/hospital/view-department')
+@query_budget(3)
 def view_departments():
-    hosp_id = request.args.get('h_id')
+    hosp_id = request.args.get('h_id', type=int)
     dept = request.args.get('dept')
-    dept_id = (Departments.query.filter(Departments.name==dept).first()).id
-    docs = Doctor.query.filter(Doctor.department_id == dept_id, Doctor.hospital_id == hosp_id)
-    hospital = Hospital.query.filter_by(id=hosp_id).first()
+    directory = get_doctor_directory()
+    if dept not in directory.department_ids:
+        abort(404)
+    docs = directory.doctors_in(directory.department_ids[dept], hosp_id)
+    hospital = directory_hospital(hosp_id)
     return render_template('hospital_dashboard_view_departments.html', docs=docs, dept=dept, hospital=hospital)
 
 @app.route('/hospital/register', methods=['GET', 'POST'])
+@query_budget(6)
 def hospital_register():
     user_email = session.get('user_email')
     if request.method == "POST":
@@ -590,9 +2169,16 @@ def hospital_register():
                 redirect_url="/hospital/login"
             )
 
-        new_user = Hospital(gid=gid, email=email, password=password, name=name, telephone=tel, pincode=pincode, address=address, lat=lat, lon=lon, emergency_capacity=emergency_capacity, cur_emergency_availability=emergency_capacity, cur_emergency_doctors = [], depts=[])
+        new_user = Hospital(gid=gid, email=email, password=password, name=name, telephone=tel, pincode=pincode, address=address, lat=lat, lon=lon, emergency_capacity=emergency_capacity, cur_emergency_availability=emergency_capacity)
         db.session.add(new_user)
+        db.session.flush()
+        if lat and lon and str(pincode).isdigit():
+            enqueue('refresh_pincode', {'pincode': int(pincode)})
+        # read before commit, which expires new_user
+        point = (new_user.id, lat, lon, int(emergency_capacity))
+        version = availability_cache.bump()
         db.session.commit()
+        availability_cache.apply(version, lambda index: index.upsert(*point))
 
         return render_template(
             "alert.html",
@@ -629,58 +2215,231 @@ def emergency_hosp():
     pincode = request.form.get('pincode')
     reason = request.form.get('emergency_reason')
 
-    lat = request.form.get('lat')
-    lon = request.form.get('long')
+    try:
+        lat, lon = parse_location(request.form.get('lat'), request.form.get('long'))
+    except ValueError as e:
+        return render_template("alert.html", message=f"Invalid location: {e}.", redirect_url="/emergency"), 400
 
-    dept, conf = classify_emergency(reason)
+    with span('classify'):
+        dept, conf = classify_emergency(reason)
 
+    with span('rank'):
+        dept_hospitals, hospitals = recommend_hospitals(dept, conf, lat, lon, pincode)
+
+    return render_template('emergency_rec.html', fname=fname, lname=lname, dob=dob, phone=phone, email=email, address=address, pincode=pincode, reason=reason, dept_hospitals=dept_hospitals, hospitals=hospitals, dept=dept)
+
+def has_location(lat, lon):
+    # the form sends '' for a missing coordinate, while 0.0 from the JSON API is a real one
+    return lat not in (None, '') and lon not in (None, '')
+
+def parse_location(lat, lon):
+    # (lat, lon) as floats, (None, None) when missing; raises ValueError for
+    # anything the spatial index can't place (text, nan, inf, off the globe)
+    if not has_location(lat, lon):
+        return None, None
+    try:
+        lat, lon = float(lat), float(lon)
+    except (TypeError, ValueError):
+        raise ValueError("lat and lon must be numbers")
+    if not (math.isfinite(lat) and math.isfinite(lon) and abs(lat) <= 90 and abs(lon) <= 180):
+        raise ValueError("lat must be a finite number in [-90, 90] and lon one in [-180, 180]")
+    return lat, lon
+
+def pincode_hospitals(pincode):
+    # last resort when the pincode has no centroid either: same pincode, and
+    # like the spatial index only hospitals with a free bed, most free first
+    return Hospital.query.filter(Hospital.pincode == pincode, Hospital.cur_emergency_availability > 0).order_by(Hospital.cur_emergency_availability.desc(), Hospital.id)
+
+def recommend_hospitals(dept, conf, lat, lon, pincode):
+    if not has_location(lat, lon):
+        # no GPS: rank from the pincode's centroid instead of an exact pincode match
+        lat, lon = (pincode_centroid(pincode) if pincode else None) or (None, None)
     if conf <= 0.55:
-        if lat and lon:
-            all_hospitals = Hospital.query.all()
-            sorted_hospitals = sorted(all_hospitals, key=lambda h: haversine(float(lat), float(lon), h.lat, h.lon))
+        if lat is not None:
             dept_hospitals = []
-            hospitals = [h for h in sorted_hospitals if h.cur_emergency_availability > 0][:3]
+            hospitals = nearest_hospitals(lat, lon)
         else:
             dept_hospitals = []
-            hospitals = Hospital.query.filter_by(pincode=pincode).limit(3).all()
+            hospitals = pincode_hospitals(pincode).limit(3).all()
     else:
         req_dept = Departments.query.filter_by(name=dept).first()
-        dept_id = req_dept.id
-        hosp = Hospital.query.all()
-        all_hosp = []
-        for h in hosp:
-            cur_depts = []
-            cur_docs = h.cur_emergency_doctors
-            for doc in cur_docs:
-                doct = Doctor.query.filter_by(id=doc).first()
-                cur_depts.append(doct.department_id)
-            if dept_id in cur_depts:
-                all_hosp.append(h.id)
-        if lat and lon:
-            if all_hosp == []:
-                all_hospitals = Hospital.query.all()
-                sorted_hospitals = sorted(all_hospitals, key=lambda h: haversine(float(lat), float(lon), h.lat, h.lon))
-                hospitals = [h for h in sorted_hospitals if h.cur_emergency_availability > 0][:3]
+        all_hosp = get_emergency_index().hospitals_for(req_dept.id) if req_dept else set()
+        if lat is not None:
+            if not all_hosp:
+                hospitals = nearest_hospitals(lat, lon)
                 dept_hospitals = []
             else:
-                all_hospitals = Hospital.query.filter(Hospital.id.in_(all_hosp)).all()
-                sorted_hospitals = sorted(all_hospitals, key=lambda h: haversine(float(lat), float(lon), h.lat, h.lon))
-                dept_hospitals = [h for h in sorted_hospitals if h.cur_emergency_availability > 0][:3]
-                hospitals = [h for h in sorted(Hospital.query.all(), key=lambda h: haversine(float(lat), float(lon), h.lat, h.lon)) if h.cur_emergency_availability > 0 and h not in dept_hospitals][:3]
+                dept_hospitals = nearest_hospitals(lat, lon, ids=all_hosp)
+                hospitals = nearest_hospitals(lat, lon, exclude={h.id for h in dept_hospitals})
         else:
-            if all_hosp == []:
+            if not all_hosp:
                 dept_hospitals = []
-                hospitals = Hospital.query.filter_by(pincode=pincode).limit(3).all()
+                hospitals = pincode_hospitals(pincode).limit(3).all()
             else:
-                dept_hospitals = Hospital.query.filter(Hospital.id.in_(all_hosp), Hospital.pincode==pincode).all()
-                hospitals = [h for h in Hospital.query.filter_by(pincode=pincode).limit(3).all() if h not in dept_hospitals][:3]
-
-
-    return render_template('emergency_rec.html', fname=fname, lname=lname, dob=dob, phone=phone, email=email, address=address, pincode=pincode, reason=reason, dept_hospitals=dept_hospitals, hospitals=hospitals, dept=dept)
+                dept_hospitals = pincode_hospitals(pincode).filter(Hospital.id.in_(all_hosp)).all()
+                hospitals = pincode_hospitals(pincode).filter(Hospital.id.notin_([h.id for h in dept_hospitals])).limit(3).all()
+    return dept_hospitals, hospitals
+
+def hospital_json(h, lat, lon):
+    distance = None
+    if has_location(lat, lon) and h.lat is not None and h.lon is not None:
+        distance = round(haversine(float(lat), float(lon), h.lat, h.lon), 3)
+    return {
+        "id": h.id,
+        "name": h.name,
+        "address": h.address,
+        "pincode": h.pincode,
+        "telephone": h.telephone,
+        "lat": h.lat,
+        "lon": h.lon,
+        "available_beds": h.cur_emergency_availability,
+        "distance_km": distance,
+    }
+
+@app.route('/api/emergency/recommendations', methods=['POST'])
+def emergency_recommendations():
+    # machine-readable /emergency_hosp for dispatch integrations: takes JSON
+    # {"reason", "lat", "lon", "pincode"} and returns the same ranking
+    data = request.get_json(silent=True) or {}
+    reason = data.get('reason')
+    lat, lon, pincode = data.get('lat'), data.get('lon'), data.get('pincode')
+    if not reason or not isinstance(reason, str):
+        return jsonify({"error": "reason is required and must be a string"}), 400
+    try:
+        lat, lon = parse_location(lat, lon)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    if lat is None and pincode is None:
+        return jsonify({"error": "lat/lon or pincode is required"}), 400
+
+    with span('classify'):
+        dept, conf = classify_emergency(reason)
+    with span('rank'):
+        dept_hospitals, hospitals = recommend_hospitals(dept, conf, lat, lon, pincode)
+    return jsonify({
+        "dept": dept,
+        "confidence": conf,
+        "dept_hospitals": [hospital_json(h, lat, lon) for h in dept_hospitals],
+        "hospitals": [hospital_json(h, lat, lon) for h in hospitals],
+    })
+
+@job('notify_hospital')
+def notify_hospital(hospital_id, booking_ids):
+    url = app.config['HOSPITAL_NOTIFY_URL']
+    if not url:
+        return
+    bookings = EmergencyBooking.query.filter(EmergencyBooking.id.in_(booking_ids)).order_by(EmergencyBooking.id).all()
+    body = json.dumps({
+        "hospital_id": hospital_id,
+        "bookings": [{"id": b.id, "patient_name": b.patient_name, "phone": b.phone, "reason": b.reason, "booking_time": b.booking_time.isoformat()} for b in bookings],
+    }).encode()
+    req = urllib.request.Request(url, data=body, headers={"Content-Type": "application/json"}, method="POST")
+    # any error raises and the job is retried
+    with urllib.request.urlopen(req, timeout=10) as response:
+        response.read()
+
+def enqueue_booking_jobs(bookings):
+    # call after flush, in the booking transaction
+    enqueue('count_emergency_bookings', {'bookings': [[b.hospital_id, b.booking_time.isoformat()] for b in bookings]})
+    by_hospital = {}
+    for b in bookings:
+        by_hospital.setdefault(b.hospital_id, []).append(b.id)
+    for hosp_id, ids in sorted(by_hospital.items()):
+        enqueue('notify_hospital', {'hospital_id': hosp_id, 'booking_ids': ids})
+
+def reserve_beds(hospital_id, count=1):
+    # takes up to `count` emergency beds with a conditional update, so
+    # concurrent bookings can never push availability below zero. returns how
+    # many were taken; call inside the booking transaction
+    take = count
+    while take > 0:
+        taken = Hospital.query.filter(Hospital.id == hospital_id, Hospital.cur_emergency_availability >= take).update(
+            {Hospital.cur_emergency_availability: Hospital.cur_emergency_availability - take}, synchronize_session=False)
+        if taken:
+            return take
+        # fewer beds than asked for, take whatever is left
+        left = db.session.query(Hospital.cur_emergency_availability).filter(Hospital.id == hospital_id).scalar() or 0
+        take = min(take - 1, left)
+    return 0
+
+def recommend_hospitals_batch(incidents, k=3):
+    # recommend_hospitals for many located incidents [(reason, lat, lon)] at
+    # once; returns [(dept, conf, dept_ranked, ranked)] with [(hosp_id, km)]
+    # lists, the same picks the single request makes
+    index = get_hospital_index()
+    emergency = get_emergency_index()
+    dept_ids = dict(db.session.query(Departments.name, Departments.id))
+    classified = classify_emergency_batch([reason for reason, lat, lon in incidents])
+
+    # incidents that rank against the same department hospitals go in one batch
+    groups = {}
+    for i, (dept, conf) in enumerate(classified):
+        all_hosp = emergency.hospitals_for(dept_ids[dept]) if conf > 0.55 and dept in dept_ids else set()
+        groups.setdefault(dept if all_hosp else None, (all_hosp, []))[1].append(i)
+
+    results = [None] * len(incidents)
+    for dept, (all_hosp, members) in groups.items():
+        points = [incidents[i][1:] for i in members]
+        if not all_hosp:
+            for i, ranked in zip(members, index.nearest_batch(points, k)):
+                results[i] = (classified[i][0], classified[i][1], [], ranked)
+            continue
+        dept_ranked = index.nearest_batch(points, k, ids=all_hosp)
+        # the general list leaves out each incident's department picks; ranking
+        # 2k and dropping those is the same as ranking with them excluded
+        wider = index.nearest_batch(points, 2 * k)
+        for i, picks, ranked in zip(members, dept_ranked, wider):
+            taken = {h for h, d in picks}
+            results[i] = (classified[i][0], classified[i][1], picks, [(h, d) for h, d in ranked if h not in taken][:k])
+    return results
+
+RANKING_BATCH_LIMIT = 10000
+
+@app.route('/api/emergency/recommendations/batch', methods=['POST'])
+def emergency_recommendations_batch():
+    # what-if runs for dispatch planning: {"incidents": [{"reason", "lat", "lon"}
+    # or {"reason", "pincode"}, ...], "k": 3} -> for each incident the dept and
+    # the hospital ids /emergency_hosp would pick, with distances
+    data = request.get_json(silent=True) or {}
+    items = data.get('incidents')
+    if not isinstance(items, list) or not items:
+        return jsonify({"error": "incidents must be a non-empty list"}), 400
+    if len(items) > RANKING_BATCH_LIMIT:
+        return jsonify({"error": f"at most {RANKING_BATCH_LIMIT} incidents per request"}), 400
+    k = data.get('k', 3)
+    if not isinstance(k, int) or not 1 <= k <= 20:
+        return jsonify({"error": "k must be between 1 and 20"}), 400
+
+    results = [None] * len(items)
+    located = []
+    for i, item in enumerate(items):
+        try:
+            if not item.get('reason') or not isinstance(item['reason'], str):
+                raise ValueError("reason is required and must be a string")
+            lat, lon = parse_location(item.get('lat'), item.get('lon'))
+            if lat is None:
+                lat, lon = pincode_centroid(item.get('pincode')) or (None, None)
+                if lat is None:
+                    raise ValueError("lat/lon or a known pincode is required")
+        except (ValueError, TypeError, AttributeError) as e:
+            results[i] = {"error": str(e)}
+            continue
+        located.append((i, (item['reason'], lat, lon)))
+
+    with span('rank'):
+        ranked = recommend_hospitals_batch([incident for i, incident in located], k)
+    for (i, incident), (dept, conf, dept_ranked, general) in zip(located, ranked):
+        results[i] = {
+            "dept": dept,
+            "confidence": conf,
+            "dept_hospitals": [{"id": h, "distance_km": round(d, 3)} for h, d in dept_ranked],
+            "hospitals": [{"id": h, "distance_km": round(d, 3)} for h, d in general],
+        }
+    return jsonify({"results": results})
 
 @app.route('/emergency/book-emergency', methods=['POST'])
 def book_emergency():
-    hospital_id = request.form.get('hospital_id')
+    hospital_id = request.form.get('hospital_id', type=int)
     fname = request.args.get('fname')
     lname = request.args.get('lname')
     dob = datetime.strptime(request.args.get('dob'), "%Y-%m-%d").date()
@@ -691,11 +2450,23 @@ def book_emergency():
     reason = request.args.get('reason')
     patient_name = f"{fname} {lname}"
 
+    if not reserve_beds(hospital_id):
+        db.session.rollback()
+        return render_template(
+            'alert.html',
+            message="Sorry, this hospital has no emergency beds left. Please choose another hospital.",
+            redirect_url=f"/emergency?{request.query_string.decode()}"
+        ), 409
+
     new_booking = EmergencyBooking(patient_name=patient_name, dob=dob, phone=phone, email=email, address=address, pincode=pincode, hospital_id=hospital_id, booking_time=datetime.now(), reason=reason)
     db.session.add(new_booking)
+    db.session.flush()
+    enqueue_booking_jobs([new_booking])
+    hospital = db.session.get(Hospital, hospital_id)
+    available = hospital.cur_emergency_availability
+    version = availability_cache.bump()
     db.session.commit()
-
-    hospital = Hospital.query.get(hospital_id)
+    availability_cache.apply(version, lambda index: index.set_availability(hospital_id, available))
 
     return render_template(
         'alert.html',
@@ -703,9 +2474,468 @@ def book_emergency():
         redirect_url="/"
     )
 
+EMERGENCY_BATCH_LIMIT = 500
+
+def emergency_booking_from(item):
+    if not isinstance(item, dict):
+        raise ValueError("expected an object")
+    for field in ('hospital_id', 'fname', 'lname', 'reason'):
+        if not item.get(field):
+            raise ValueError(f"missing {field}")
+    # anything else would reach the insert (and fail the whole batch) or be
+    # stored as its repr
+    for field in ('fname', 'lname', 'reason', 'dob', 'phone', 'email', 'address'):
+        if item.get(field) is not None and not isinstance(item[field], str):
+            raise ValueError(f"{field} must be a string")
+    for field in ('hospital_id', 'pincode'):
+        value = item.get(field)
+        if value is not None and not (type(value) is int or isinstance(value, str) and value.isdigit()):
+            raise ValueError(f"{field} must be an integer")
+    dob = item.get('dob')
+    return EmergencyBooking(
+        patient_name=f"{item['fname']} {item['lname']}",
+        dob=datetime.strptime(dob, "%Y-%m-%d").date() if dob else None,
+        phone=item.get('phone'),
+        email=item.get('email'),
+        address=item.get('address'),
+        pincode=int(item['pincode']) if item.get('pincode') else None,
+        hospital_id=int(item['hospital_id']),
+        booking_time=datetime.now(),
+        reason=item['reason'],
+    )
 
-        
+@app.route('/api/emergency/bookings', methods=['POST'])
+def emergency_bookings():
+    # batch booking for dispatch centres: {"bookings": [{"hospital_id", "fname",
+    # "lname", "reason", "dob", "phone", "email", "address", "pincode"}, ...]}.
+    # each hospital's beds are taken with one conditional update and handed out
+    # in submission order; whoever is left over gets "no_beds"
+    data = request.get_json(silent=True) or {}
+    items = data.get('bookings')
+    if not isinstance(items, list) or not items:
+        return jsonify({"error": "bookings must be a non-empty list"}), 400
+    if len(items) > EMERGENCY_BATCH_LIMIT:
+        return jsonify({"error": f"at most {EMERGENCY_BATCH_LIMIT} bookings per request"}), 400
+
+    results = [None] * len(items)
+    wanted = {}
+    for i, item in enumerate(items):
+        try:
+            booking = emergency_booking_from(item)
+        except (ValueError, TypeError) as e:
+            results[i] = {"status": "invalid", "error": str(e)}
+            continue
+        wanted.setdefault(booking.hospital_id, []).append((i, booking))
+
+    booked = []
+    # a fixed hospital order keeps concurrent batches from deadlocking
+    for hosp_id in sorted(wanted):
+        taken = reserve_beds(hosp_id, len(wanted[hosp_id]))
+        for n, (i, booking) in enumerate(wanted[hosp_id]):
+            if n < taken:
+                db.session.add(booking)
+                booked.append((i, booking))
+            else:
+                results[i] = {"status": "no_beds", "hospital_id": hosp_id}
+
+    if booked:
+        db.session.flush()
+        enqueue_booking_jobs([booking for i, booking in booked])
+        for i, booking in booked:
+            results[i] = {"status": "booked", "hospital_id": booking.hospital_id, "booking_id": booking.id}
+        available = dict(db.session.query(Hospital.id, Hospital.cur_emergency_availability).filter(Hospital.id.in_({b.hospital_id for i, b in booked})))
+        version = availability_cache.bump()
+        db.session.commit()
 
-if __name__ == '__main__':
+        def set_all(index):
+            for hosp_id, beds in available.items():
+                index.set_availability(hosp_id, beds)
+        availability_cache.apply(version, set_all)
+    else:
+        db.session.rollback()
+    return jsonify({"results": results})
+
+
+#bulk import
+# flask import-data <kind> <file> loads hospitals, departments, doctors or
+# slot schedules from CSV or NDJSON (.ndjson/.jsonl). rows are streamed in
+# chunks of IMPORT_CHUNK, each chunk is one lookup query, one executemany
+# insert and one bulk update, so memory stays flat however big the file is.
+# hospitals are matched by gid (then email), doctors by hospital + name;
+# rows that fail validation are reported by line number and skipped
+IMPORT_CHUNK = 1000
+
+def read_rows(path):
+    # yields (line number, row); NDJSON lines are decoded later so a bad line
+    # is a row error rather than the end of the import
+    with open(path, newline='') as f:
+        if path.endswith(('.ndjson', '.jsonl')):
+            for line_no, line in enumerate(f, 1):
+                if line.strip():
+                    yield line_no, line
+        else:
+            reader = csv.DictReader(f)
+            for row in reader:
+                yield reader.line_num, row
+
+def import_text(row, field, required=True):
+    value = row.get(field)
+    if value is None or str(value).strip() == '':
+        if required:
+            raise ValueError(f"missing {field}")
+        return None
+    return str(value).strip()
+
+def import_number(row, field, kind=int, required=True):
+    value = import_text(row, field, required)
+    if value is None:
+        return None
+    try:
+        return kind(value)
+    except ValueError:
+        raise ValueError(f"{field} must be a number, got {value!r}")
+
+def import_slots(row, required=False):
+    value = row.get('slots')
+    if isinstance(value, str) and value.strip():
+        # CSV cells hold either a JSON list or "09:00-09:30;09:30-10:00"
+        value = json.loads(value) if value.strip().startswith('[') else value.split(';')
+    if not value:
+        if required:
+            raise ValueError("missing slots")
+        return None
+    if not isinstance(value, list):
+        raise ValueError("slots must be a list")
+    return [str(slot).strip() for slot in value if str(slot).strip()]
+
+def hospital_ref(row, required=True):
+    gid = import_text(row, 'hospital_gid', required=False)
+    email = import_text(row, 'hospital_email', required=False)
+    if required and not (gid or email):
+        raise ValueError("missing hospital_gid or hospital_email")
+    return gid, email
+
+def resolve_hospitals(refs):
+    # (gid, email) -> hospital id for every ref that exists
+    gids = {gid for gid, email in refs if gid}
+    emails = {email for gid, email in refs if email}
+    by_gid, by_email = {}, {}
+    if gids or emails:
+        rows = db.session.query(Hospital.id, Hospital.gid, Hospital.email).filter(Hospital.gid.in_(gids) | Hospital.email.in_(emails))
+        for hosp_id, gid, email in rows:
+            by_gid[gid] = hosp_id
+            by_email[email] = hosp_id
+    found = {}
+    for gid, email in refs:
+        hosp_id = by_gid.get(gid) or by_email.get(email)
+        if hosp_id:
+            found[(gid, email)] = hosp_id
+    return found
+
+def link_departments(pairs):
+    # inserts whichever (hospital_id, department_id) pairs are missing
+    if not pairs:
+        return
+    hosp_ids = {hosp_id for hosp_id, dept_id in pairs}
+    linked = set(db.session.query(HospitalDepartment.hospital_id, HospitalDepartment.department_id).filter(HospitalDepartment.hospital_id.in_(hosp_ids)))
+    missing = [{'hospital_id': h, 'department_id': d} for h, d in pairs if (h, d) not in linked]
+    if missing:
+        db.session.execute(db.insert(HospitalDepartment), missing)
+        directory_cache.record(links=[[row['hospital_id'], row['department_id']] for row in missing])
+
+def clean_hospital(row):
+    return {
+        'gid': import_text(row, 'gid'),
+        'email': import_text(row, 'email'),
+        'password': import_text(row, 'password'),
+        'name': import_text(row, 'name'),
+        'address': import_text(row, 'address'),
+        'telephone': import_text(row, 'telephone'),
+        'pincode': import_number(row, 'pincode'),
+        'lat': import_number(row, 'lat', float, required=False),
+        'lon': import_number(row, 'lon', float, required=False),
+        'emergency_capacity': import_number(row, 'emergency_capacity'),
+        'cur_emergency_availability': import_number(row, 'available_beds', required=False),
+    }
+
+def upsert_hospitals(chunk):
+    rows = {record['gid']: record for line_no, record in chunk}
+    existing = resolve_hospitals([(r['gid'], r['email']) for r in rows.values()])
+    inserts, updates = [], []
+    for record in rows.values():
+        hosp_id = existing.get((record['gid'], record['email']))
+        if hosp_id:
+            # blank optional columns leave the stored value alone
+            updates.append(dict({k: v for k, v in record.items() if v is not None}, id=hosp_id))
+        else:
+            if record['cur_emergency_availability'] is None:
+                record['cur_emergency_availability'] = record['emergency_capacity']
+            inserts.append(record)
+    if inserts:
+        db.session.execute(db.insert(Hospital), inserts)
+    if updates:
+        db.session.execute(db.update(Hospital), updates)
+        # new hospitals are filled into the doctor directory on first use
+        directory_cache.record(hospitals=[row['id'] for row in updates])
+    return len(inserts), len(updates), []
+
+def clean_department(row):
+    return {'name': import_text(row, 'name'), 'hospital': hospital_ref(row, required=False)}
+
+def upsert_departments(chunk):
+    names = {record['name'] for line_no, record in chunk}
+    existing = dict(db.session.query(Departments.name, Departments.id).filter(Departments.name.in_(names)))
+    new = sorted(names - set(existing))
+    if new:
+        db.session.execute(db.insert(Departments), [{'name': name} for name in new])
+        existing = dict(db.session.query(Departments.name, Departments.id).filter(Departments.name.in_(names)))
+        directory_cache.record(departments=[existing[name] for name in new])
+    hospitals = resolve_hospitals([record['hospital'] for line_no, record in chunk if any(record['hospital'])])
+    pairs, rejected = set(), []
+    for line_no, record in chunk:
+        if not any(record['hospital']):
+            continue
+        if record['hospital'] not in hospitals:
+            rejected.append((line_no, f"unknown hospital {record['hospital'][0] or record['hospital'][1]}"))
+            continue
+        pairs.add((hospitals[record['hospital']], existing[record['name']]))
+    link_departments(pairs)
+    return len(new), len(names) - len(new), rejected
+
+def clean_doctor(row):
+    return {
+        'hospital': hospital_ref(row),
+        'name': import_text(row, 'name'),
+        'department': import_text(row, 'department'),
+        'qualification': import_text(row, 'qualification'),
+        'experience': import_number(row, 'experience'),
+        'slots': import_slots(row),
+    }
+
+def clean_schedule(row):
+    return {'hospital': hospital_ref(row), 'name': import_text(row, 'doctor'), 'slots': import_slots(row, required=True)}
+
+def match_doctors(chunk):
+    # resolves hospitals and existing doctors for a chunk; returns
+    # {(hospital_id, name): (line_no, record)}, {(hospital_id, name): doctor_id}
+    # and the rows whose hospital does not exist
+    hospitals = resolve_hospitals([record['hospital'] for line_no, record in chunk])
+    rows, rejected = {}, []
+    for line_no, record in chunk:
+        hosp_id = hospitals.get(record['hospital'])
+        if not hosp_id:
+            rejected.append((line_no, f"unknown hospital {record['hospital'][0] or record['hospital'][1]}"))
+            continue
+        rows[(hosp_id, record['name'])] = (line_no, record)
+    existing = {}
+    if rows:
+        found = (
+            db.session.query(Doctor.id, Doctor.hospital_id, Doctor.name)
+            .filter(Doctor.hospital_id.in_({h for h, n in rows}), Doctor.name.in_({n for h, n in rows}))
+            .order_by(Doctor.id.desc())
+        )
+        # where a hospital has two doctors of the same name the oldest one wins
+        existing = {(hosp_id, name): doc_id for doc_id, hosp_id, name in found}
+    return rows, existing, rejected
+
+def upsert_doctors(chunk):
+    rows, existing, rejected = match_doctors(chunk)
+    depts = dict(db.session.query(Departments.name, Departments.id))
+    inserts, updates, pairs = [], [], set()
+    for (hosp_id, name), (line_no, record) in rows.items():
+        dept_id = depts.get(record['department'])
+        if not dept_id:
+            rejected.append((line_no, f"unknown department {record['department']}"))
+            continue
+        values = {'name': name, 'hospital_id': hosp_id, 'department_id': dept_id, 'qualification': record['qualification'], 'experience': record['experience']}
+        pairs.add((hosp_id, dept_id))
+        if (hosp_id, name) in existing:
+            if record['slots'] is not None:
+                values['slots'] = record['slots']
+            updates.append(dict(values, id=existing[(hosp_id, name)]))
+        else:
+            inserts.append(dict(values, slots=record['slots'] or []))
+    if inserts:
+        ids = db.session.execute(db.insert(Doctor).returning(Doctor.id), inserts).scalars().all()
+        directory_cache.record(doctors=ids)
+    if updates:
+        db.session.execute(db.update(Doctor), updates)
+        directory_cache.record(doctors=[row['id'] for row in updates])
+    # a doctor's department has to be one of the hospital's, as in the form
+    link_departments(pairs)
+    return len(inserts), len(updates), rejected
+
+def update_schedules(chunk):
+    rows, existing, rejected = match_doctors(chunk)
+    updates = []
+    for key, (line_no, record) in rows.items():
+        if key not in existing:
+            rejected.append((line_no, f"unknown doctor {record['name']}"))
+            continue
+        updates.append({'id': existing[key], 'slots': record['slots']})
+    if updates:
+        db.session.execute(db.update(Doctor), updates)
+        directory_cache.record(doctors=[row['id'] for row in updates])
+    return 0, len(updates), rejected
+
+# kind -> (validate one row, write one chunk, caches the chunk invalidates,
+# the key a row may appear under only once per file or None)
+IMPORTERS = {
+    'hospitals': (clean_hospital, upsert_hospitals, [availability_cache, directory_cache], lambda record: record['gid']),
+    'departments': (clean_department, upsert_departments, [page_cache('departments'), directory_cache], None),
+    'doctors': (clean_doctor, upsert_doctors, [emergency_cache, directory_cache], lambda record: (record['hospital'], record['name'])),
+    'slots': (clean_schedule, update_schedules, [directory_cache], lambda record: (record['hospital'], record['name'])),
+}
+
+def batched(rows, size):
+    rows = iter(rows)
+    while True:
+        batch = list(itertools.islice(rows, size))
+        if not batch:
+            return
+        yield batch
+
+def write_chunk(upsert, caches, chunk):
+    # returns (inserted, updated, rejected rows); a constraint violation (say an
+    # email already used by another hospital) spoils the whole batch, so the
+    # chunk is then redone row by row to pin down the offending lines
+    try:
+        inserted, updated, rejected = upsert(chunk)
+        for cache in caches:
+            cache.bump()
+        db.session.commit()
+    except IntegrityError:
+        db.session.rollback()
+        if len(chunk) == 1:
+            return 0, 0, [(chunk[0][0], "conflicts with an existing row")]
+        inserted = updated = 0
+        rejected = []
+        for row in chunk:
+            i, u, r = write_chunk(upsert, caches, [row])
+            inserted, updated = inserted + i, updated + u
+            rejected += r
+        return inserted, updated, rejected
+    for cache in caches:
+        cache.expire()
+    return inserted, updated, rejected
+
+def import_file(kind, path, chunk_size=IMPORT_CHUNK, on_error=None):
+    clean, upsert, caches, row_key = IMPORTERS[kind]
+    stats = {'rows': 0, 'inserted': 0, 'updated': 0, 'rejected': 0}
+    # key -> line it was first seen on; the upserts keep one row per key, so a
+    # repeat would otherwise vanish from the counts
+    seen = {}
+
+    def reject(line_no, error):
+        stats['rejected'] += 1
+        if on_error:
+            on_error(line_no, error)
+
+    for batch in batched(read_rows(path), chunk_size):
+        chunk = []
+        for line_no, row in batch:
+            stats['rows'] += 1
+            try:
+                if isinstance(row, str):
+                    row = json.loads(row)
+                    if not isinstance(row, dict):
+                        raise ValueError("expected a JSON object")
+                record = clean(row)
+                if row_key:
+                    key = row_key(record)
+                    if key in seen:
+                        raise ValueError(f"duplicate of line {seen[key]}")
+                    seen[key] = line_no
+                chunk.append((line_no, record))
+            except ValueError as e:
+                reject(line_no, e)
+        if not chunk:
+            continue
+        inserted, updated, rejected = write_chunk(upsert, caches, chunk)
+        stats['inserted'] += inserted
+        stats['updated'] += updated
+        for line_no, error in rejected:
+            reject(line_no, error)
+        db.session.expunge_all()
+    return stats
+
+@app.cli.command("import-data", help="Upsert hospitals, departments, doctors or slots from a CSV/NDJSON file.")
+@click.argument("kind", type=click.Choice(list(IMPORTERS)))
+@click.argument("path", type=click.Path(exists=True, dir_okay=False))
+@click.option("--chunk-size", default=IMPORT_CHUNK, show_default=True, help="rows written per transaction")
+def import_data_command(kind, path, chunk_size):
     init_db(app)
-    app.run(debug=True)
\ No newline at end of file
+    start = time.perf_counter()
+    stats = import_file(kind, path, chunk_size, lambda line_no, error: click.echo(f"{path}:{line_no}: {error}", err=True))
+    click.echo(f"{stats['rows']} rows in {time.perf_counter() - start:.1f}s: {stats['inserted']} inserted, {stats['updated']} updated, {stats['rejected']} rejected")
+
+
+def build_pincode_centroids(source=None):
+    # centroids come from the hospitals and patients that registered with GPS,
+    # averaged per pincode; a pincode directory file (pincode, lat, lon columns)
+    # overrides them where it has the pincode. returns (pincodes, rejected rows)
+    centroids = {}
+    for model in (Patient, Hospital):
+        rows = (
+            db.session.query(model.pincode, func.avg(model.lat), func.avg(model.lon), func.count())
+            .filter(model.lat.isnot(None), model.lon.isnot(None))
+            .group_by(model.pincode)
+        )
+        for pincode, lat, lon, n in rows:
+            if pincode in centroids:
+                old_lat, old_lon, old_n = centroids[pincode]
+                lat, lon, n = (old_lat * old_n + lat * n) / (old_n + n), (old_lon * old_n + lon * n) / (old_n + n), old_n + n
+            centroids[pincode] = (lat, lon, n)
+    rejected = []
+    if source:
+        for line_no, row in read_rows(source):
+            try:
+                if isinstance(row, str):
+                    row = json.loads(row)
+                centroids[import_number(row, 'pincode')] = (import_number(row, 'lat', float), import_number(row, 'lon', float), 0)
+            except (ValueError, AttributeError) as e:
+                rejected.append((line_no, e))
+
+    PincodeCentroid.query.delete()
+    rows = [{'pincode': p, 'lat': lat, 'lon': lon} for p, (lat, lon, n) in sorted(centroids.items())]
+    for batch in batched(rows, IMPORT_CHUNK):
+        db.session.execute(db.insert(PincodeCentroid), batch)
+    pincode_cache.bump()
+    db.session.commit()
+    pincode_cache.clear()
+    return len(rows), rejected
+
+@app.cli.command("build-pincodes", help="Rebuild the pincode centroid table used for requests without GPS.")
+@click.option("--source", type=click.Path(exists=True, dir_okay=False), help="CSV/NDJSON pincode directory with pincode, lat and lon columns")
+def build_pincodes_command(source):
+    init_db(app)
+    count, rejected = build_pincode_centroids(source)
+    for line_no, error in rejected:
+        click.echo(f"{source}:{line_no}: {error}", err=True)
+    click.echo(f"{count} pincodes, {len(rejected)} rejected")
+
+
+def dispose_engine():
+    with app.app_context():
+        db.engine.dispose(close=False)
+
+# forked workers must not share the parent's pooled connections
+os.register_at_fork(after_in_child=dispose_engine)
+
+def warm_caches():
+    for cache in (availability_cache, emergency_cache, directory_cache, pincode_cache):
+        cache.get()
+
+def create_app():
+    # startup for servers: migrate once and load the in-memory caches (which
+    # forked workers inherit), then drop connections so a preloading gunicorn
+    # master forks workers without open database handles
+    init_db(app)
+    with app.app_context():
+        warm_caches()
+        db.engine.dispose()
+    return app
+
+
+if __name__ == '__main__':
+    create_app().run(debug=True)
\ No newline at end of file
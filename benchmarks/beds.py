@@ -0,0 +1,111 @@
+"""Emergency bed overbooking stress test.
+
+Gives a handful of hospitals a few free beds each, then lets several worker
+processes race for them through /emergency/book-emergency and the batch
+/api/emergency/bookings endpoint. Afterwards every hospital must have
+capacity - bookings == available beds and never fewer than zero free beds.
+
+    python -m benchmarks.beds --workers 8 --contested 5 --beds 20
+"""
+import argparse
+import multiprocessing
+import os
+import random
+import time
+
+from benchmarks.common import latency_summary, load_app, write_report
+from benchmarks.dataset import add_scale_arguments, open_dataset, scale_from_args
+
+BOOKING_QUERY = "fname=Load&lname=Test&dob=1990-01-01&phone=1&email=load%40test&address=x&pincode=700000&reason=stress"
+
+
+def worker(database_url, hospital_ids, attempts, seed, results):
+    app_module = load_app(database_url)
+    client = app_module.app.test_client()
+    rng = random.Random(seed)
+    samples = []
+    booked = rejected = errors = 0
+    for _ in range(attempts):
+        start = time.perf_counter()
+        if rng.random() < 0.5:
+            response = client.post(f"/emergency/book-emergency?{BOOKING_QUERY}", data={"hospital_id": str(rng.choice(hospital_ids))})
+            booked += response.status_code == 200
+            rejected += response.status_code == 409
+            errors += response.status_code not in (200, 409)
+        else:
+            batch = [{"hospital_id": rng.choice(hospital_ids), "fname": "Load", "lname": "Batch", "reason": "stress"} for _ in range(rng.randint(2, 10))]
+            response = client.post("/api/emergency/bookings", json={"bookings": batch})
+            if response.status_code != 200:
+                errors += 1
+            else:
+                statuses = [r["status"] for r in response.get_json()["results"]]
+                booked += statuses.count("booked")
+                rejected += statuses.count("no_beds")
+        samples.append(time.perf_counter() - start)
+    results.put((samples, booked, rejected, errors))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--db", default="bench-beds.db", help="SQLite file (recreated unless --reuse)")
+    parser.add_argument("--reuse", action="store_true")
+    parser.add_argument("--workers", type=int, default=8)
+    parser.add_argument("--contested", type=int, default=5, help="hospitals being raced for")
+    parser.add_argument("--beds", type=int, default=20, help="free beds per contested hospital")
+    parser.add_argument("--attempts", type=int, default=50, help="requests per worker")
+    parser.add_argument("--out", help="also write the JSON report to this file")
+    add_scale_arguments(parser)
+    parser.set_defaults(hospitals=200, appointments=1000, patients=1000, bookings=0)
+    args = parser.parse_args()
+
+    database_url = os.environ.get("DATABASE_URL")
+    if not database_url:
+        open_dataset(args.db, scale_from_args(args), args.seed, reuse=args.reuse)
+        database_url = f"sqlite:///{os.path.abspath(args.db)}"
+    app_module = load_app(database_url)
+    Hospital, EmergencyBooking = app_module.Hospital, app_module.EmergencyBooking
+    with app_module.app.app_context():
+        db = app_module.db
+        hospital_ids = [row.id for row in db.session.query(Hospital.id).order_by(Hospital.id).limit(args.contested)]
+        EmergencyBooking.query.filter(EmergencyBooking.hospital_id.in_(hospital_ids)).delete(synchronize_session=False)
+        Hospital.query.filter(Hospital.id.in_(hospital_ids)).update(
+            {Hospital.emergency_capacity: args.beds, Hospital.cur_emergency_availability: args.beds}, synchronize_session=False)
+        db.session.commit()
+        db.engine.dispose()
+
+    ctx = multiprocessing.get_context("spawn")
+    results = ctx.Queue()
+    procs = [ctx.Process(target=worker, args=(database_url, hospital_ids, args.attempts, args.seed + i, results)) for i in range(args.workers)]
+    for proc in procs:
+        proc.start()
+    collected = [results.get() for _ in procs]
+    for proc in procs:
+        proc.join()
+
+    with app_module.app.app_context():
+        db = app_module.db
+        beds = dict(db.session.query(Hospital.id, Hospital.cur_emergency_availability).filter(Hospital.id.in_(hospital_ids)))
+        bookings = dict(
+            db.session.query(EmergencyBooking.hospital_id, db.func.count()).filter(EmergencyBooking.hospital_id.in_(hospital_ids)).group_by(EmergencyBooking.hospital_id)
+        )
+    hospitals = {
+        str(hosp_id): {"available": beds[hosp_id], "booked": bookings.get(hosp_id, 0), "consistent": beds[hosp_id] >= 0 and bookings.get(hosp_id, 0) + beds[hosp_id] == args.beds}
+        for hosp_id in hospital_ids
+    }
+    booked = sum(b for _, b, _, _ in collected)
+    report = {
+        "workers": args.workers,
+        "beds": args.beds * len(hospital_ids),
+        "booked": booked,
+        "rejected": sum(r for _, _, r, _ in collected),
+        "errors": sum(e for _, _, _, e in collected),
+        "overbooked": max(0, sum(bookings.values()) - args.beds * len(hospital_ids)),
+        "consistent": all(h["consistent"] for h in hospitals.values()) and booked == sum(bookings.values()),
+        "hospitals": hospitals,
+        "requests": latency_summary([s for batch, _, _, _ in collected for s in batch]),
+    }
+    write_report(report, args.out)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,82 @@
+"""Bulk import throughput: flask import-data against a fresh database.
+
+Writes NDJSON files for the requested number of hospitals and doctors, imports
+them into a scratch SQLite database, then imports the doctors a second time to
+time the update path.
+
+    python -m benchmarks.bulk_import --hospitals 1000 --doctors 100000
+"""
+import argparse
+import json
+import os
+import random
+import shutil
+import tempfile
+import time
+
+from benchmarks.common import load_app, write_report
+from benchmarks.dataset import QUALIFICATIONS, SLOTS
+
+
+def write_ndjson(path, rows):
+    with open(path, "w") as f:
+        for row in rows:
+            f.write(json.dumps(row) + "\n")
+
+
+def write_files(directory, hospitals, doctors, dept_names, seed=0):
+    rng = random.Random(seed)
+    paths = {kind: os.path.join(directory, f"{kind}.ndjson") for kind in ("hospitals", "doctors", "slots")}
+    write_ndjson(paths["hospitals"], ({
+        "gid": f"G{i}", "email": f"import{i}@bench.test", "password": "bench", "name": f"Import Hospital {i}",
+        "address": f"{i} Import Road", "telephone": "9000000000", "pincode": 700000 + i % 500,
+        "lat": rng.uniform(8, 34), "lon": rng.uniform(69, 95), "emergency_capacity": rng.randint(5, 50),
+    } for i in range(1, hospitals + 1)))
+    write_ndjson(paths["doctors"], ({
+        "hospital_gid": f"G{i % hospitals + 1}", "name": f"Dr Import {i}", "department": rng.choice(dept_names),
+        "qualification": rng.choice(QUALIFICATIONS), "experience": rng.randint(1, 35),
+        "slots": sorted(rng.sample(SLOTS, rng.randint(2, 6))),
+    } for i in range(1, doctors + 1)))
+    write_ndjson(paths["slots"], ({
+        "hospital_gid": f"G{i % hospitals + 1}", "doctor": f"Dr Import {i}", "slots": sorted(rng.sample(SLOTS, 3)),
+    } for i in range(1, doctors + 1)))
+    return paths
+
+
+def timed_import(app_module, kind, path, chunk_size):
+    start = time.perf_counter()
+    stats = app_module.import_file(kind, path, chunk_size)
+    elapsed = time.perf_counter() - start
+    return dict(stats, seconds=round(elapsed, 2), rows_per_sec=round(stats["rows"] / elapsed, 1) if elapsed else 0.0)
+
+
+def run(hospitals=1000, doctors=100000, chunk_size=None, seed=0):
+    scratch = tempfile.mkdtemp(prefix="hospitalizee-import-")
+    app_module = load_app(f"sqlite:///{os.path.join(scratch, 'import.db')}")
+    app_module.init_db(app_module.app)
+    chunk_size = chunk_size or app_module.IMPORT_CHUNK
+    report = {"hospitals": hospitals, "doctors": doctors, "chunk_size": chunk_size}
+    with app_module.app.app_context():
+        dept_names = [d.name for d in app_module.Departments.query.all()]
+        paths = write_files(scratch, hospitals, doctors, dept_names, seed)
+        report["hospitals_insert"] = timed_import(app_module, "hospitals", paths["hospitals"], chunk_size)
+        report["doctors_insert"] = timed_import(app_module, "doctors", paths["doctors"], chunk_size)
+        report["doctors_update"] = timed_import(app_module, "doctors", paths["doctors"], chunk_size)
+        report["slots_update"] = timed_import(app_module, "slots", paths["slots"], chunk_size)
+    shutil.rmtree(scratch, ignore_errors=True)
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--hospitals", type=int, default=1000)
+    parser.add_argument("--doctors", type=int, default=100000)
+    parser.add_argument("--chunk-size", type=int, help="rows per transaction (defaults to app.IMPORT_CHUNK)")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--out", help="also write the JSON report to this file")
+    args = parser.parse_args()
+    write_report(run(args.hospitals, args.doctors, args.chunk_size, args.seed), args.out)
+
+
+if __name__ == "__main__":
+    main()
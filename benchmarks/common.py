@@ -0,0 +1,53 @@
+import importlib
+import json
+import os
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def load_app(database_url=None):
+    # database_url only takes effect on the first import of app.py
+    if database_url:
+        os.environ["DATABASE_URL"] = database_url
+    if ROOT not in sys.path:
+        sys.path.insert(0, ROOT)
+    return importlib.import_module("app")
+
+
+def load_callable(spec):
+    # "module:function", e.g. "app:classify_emergency"
+    module_name, func_name = spec.split(":")
+    if module_name == "app":
+        module = load_app()
+    else:
+        module = importlib.import_module(module_name)
+    return getattr(module, func_name)
+
+
+def percentile(values, pct):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    k = (len(values) - 1) * pct / 100
+    lo = int(k)
+    hi = min(lo + 1, len(values) - 1)
+    return values[lo] + (values[hi] - values[lo]) * (k - lo)
+
+
+def latency_summary(samples):
+    total = sum(samples)
+    return {
+        "count": len(samples),
+        "per_sec": round(len(samples) / total, 1) if total else 0.0,
+        "p50_ms": round(percentile(samples, 50) * 1000, 4),
+        "p99_ms": round(percentile(samples, 99) * 1000, 4),
+    }
+
+
+def write_report(report, path=None):
+    text = json.dumps(report, indent=2, sort_keys=True)
+    if path:
+        with open(path, "w") as f:
+            f.write(text + "\n")
+    print(text)
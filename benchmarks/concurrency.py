@@ -0,0 +1,108 @@
+"""Write throughput with several worker processes sharing one database.
+
+Each worker process imports the app on its own, like a gunicorn worker, and
+hammers the booking routes for --seconds while optional reader processes load
+hospital dashboards. Run it once per journal mode to compare:
+
+    python -m benchmarks.concurrency --workers 4
+    SQLITE_JOURNAL_MODE=DELETE python -m benchmarks.concurrency --workers 4
+"""
+import argparse
+import multiprocessing
+import os
+import random
+import time
+
+from benchmarks.common import latency_summary, load_app, write_report
+from benchmarks.dataset import SLOTS, add_scale_arguments, open_dataset, scale_from_args
+
+
+def worker(role, database_url, seconds, seed, counts, results):
+    app_module = load_app(database_url)
+    client = app_module.app.test_client()
+    rng = random.Random(seed)
+    if role == "writer":
+        with client.session_transaction() as sess:
+            sess["patient_id"] = rng.randint(1, counts["patients"])
+    samples = []
+    errors = 0
+    deadline = time.perf_counter() + seconds
+    while time.perf_counter() < deadline:
+        start = time.perf_counter()
+        if role == "writer" and rng.random() < 0.5:
+            doctor = rng.randint(1, counts["doctors"])
+            response = client.post("/patient/confirm-appointment", data={
+                "fname": "Load", "lname": "Test", "date": f"2031-{rng.randint(1, 12):02d}-{rng.randint(1, 28):02d}",
+                "doct_id": f"{doctor},{counts['doctor_hospitals'][doctor]}", "slot": rng.choice(SLOTS),
+            })
+        elif role == "writer":
+            response = client.post(
+                "/emergency/book-emergency?fname=Load&lname=Test&dob=1990-01-01&phone=1&email=load%40test&address=x&pincode=700000&reason=load",
+                data={"hospital_id": str(rng.randint(1, counts["hospitals"]))},
+            )
+        else:
+            response = client.get(f"/hospital/dashboard?user_id={rng.randint(1, counts['hospitals'])}")
+        samples.append(time.perf_counter() - start)
+        errors += response.status_code >= 500
+    results.put((role, samples, errors))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--db", default="bench-concurrency.db", help="SQLite file (recreated unless --reuse)")
+    parser.add_argument("--reuse", action="store_true")
+    parser.add_argument("--workers", type=int, default=4, help="writer processes")
+    parser.add_argument("--readers", type=int, default=2, help="reader processes")
+    parser.add_argument("--seconds", type=float, default=10)
+    parser.add_argument("--out", help="also write the JSON report to this file")
+    add_scale_arguments(parser)
+    parser.set_defaults(hospitals=200, appointments=10000, patients=2000, bookings=1000)
+    args = parser.parse_args()
+
+    database_url = os.environ.get("DATABASE_URL")
+    if not database_url:
+        open_dataset(args.db, scale_from_args(args), args.seed, reuse=args.reuse)
+        database_url = f"sqlite:///{os.path.abspath(args.db)}"
+    app_module = load_app(database_url)
+    with app_module.app.app_context():
+        db = app_module.db
+        counts = {
+            "patients": db.session.query(db.func.max(app_module.Patient.id)).scalar(),
+            "hospitals": db.session.query(db.func.max(app_module.Hospital.id)).scalar(),
+            "doctors": db.session.query(db.func.max(app_module.Doctor.id)).scalar(),
+            "doctor_hospitals": dict(db.session.query(app_module.Doctor.id, app_module.Doctor.hospital_id).all()),
+        }
+        db.engine.dispose()
+
+    ctx = multiprocessing.get_context("spawn")
+    results = ctx.Queue()
+    roles = ["writer"] * args.workers + ["reader"] * args.readers
+    procs = [
+        ctx.Process(target=worker, args=(role, database_url, args.seconds, args.seed + i, counts, results))
+        for i, role in enumerate(roles)
+    ]
+    for proc in procs:
+        proc.start()
+    collected = [results.get() for _ in procs]
+    for proc in procs:
+        proc.join()
+
+    report = {
+        "database": database_url.split("://")[0],
+        "journal_mode": app_module.app.config["SQLITE_JOURNAL_MODE"] if database_url.startswith("sqlite") else None,
+        "workers": args.workers,
+        "readers": args.readers,
+        "seconds": args.seconds,
+    }
+    for role in ("writer", "reader"):
+        samples = [s for r, batch, _ in collected if r == role for s in batch]
+        summary = latency_summary(samples)
+        # per_sec above is per process; total throughput is what the workers achieved together
+        summary["total_per_sec"] = round(len(samples) / args.seconds, 1)
+        summary["errors"] = sum(e for r, _, e in collected if r == role)
+        report[role + "s"] = summary
+    write_report(report, args.out)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,183 @@
+"""Seeded synthetic dataset for the route benchmarks.
+
+    python -m benchmarks.dataset --db /tmp/bench.db --hospitals 10000 --appointments 1000000
+"""
+import argparse
+import os
+import random
+import time
+from datetime import date, datetime, timedelta
+
+from benchmarks.common import load_app
+
+SLOTS = ["09:00-09:30", "09:30-10:00", "10:00-11:00", "11:00-12:00", "12:00-13:00", "14:00-15:00", "15:00-16:00", "16:00-17:00"]
+QUALIFICATIONS = ["MBBS", "MBBS,MD", "MBBS,MS", "MBBS,DNB", "MBBS,MD,DM"]
+REASONS = [
+    "chest pain", "severe headache and dizziness", "fracture after a fall", "breathing difficulty",
+    "stomach pain and vomit", "ear pain", "blurred vision", "skin rash", "panic attack", "high fever",
+]
+CHUNK = 20000
+
+
+def default_scale():
+    return {
+        "hospitals": 1000,
+        "doctors_per_hospital": 10,
+        "patients": 10000,
+        "appointments": 100000,
+        "bookings": 10000,
+        "pincodes": 500,
+    }
+
+
+def insert_chunks(db, model, rows):
+    buffer = []
+    for row in rows:
+        buffer.append(row)
+        if len(buffer) >= CHUNK:
+            db.session.execute(db.insert(model), buffer)
+            buffer = []
+    if buffer:
+        db.session.execute(db.insert(model), buffer)
+    db.session.commit()
+
+
+def generate(app_module, scale, seed=0):
+    # fills an empty database; ids are assigned here so the benchmarks can pick
+    # random rows without querying for them
+    rng = random.Random(seed)
+    db = app_module.db
+    today = date.today()
+    counts = {}
+
+    with app_module.app.app_context():
+        dept_ids = [d.id for d in app_module.Departments.query.all()]
+        pincodes = [700000 + i for i in range(scale["pincodes"])]
+        centroids = {p: (rng.uniform(8, 34), rng.uniform(69, 95)) for p in pincodes}
+
+        hospitals = []
+        for i in range(1, scale["hospitals"] + 1):
+            pincode = rng.choice(pincodes)
+            lat, lon = centroids[pincode]
+            capacity = rng.randint(5, 60)
+            hospitals.append({
+                "id": i, "gid": f"GID{i:07d}", "email": f"hospital{i}@bench.test", "password": "bench",
+                "name": f"Hospital {i}", "address": f"{i} Bench Road", "telephone": f"033{i:07d}",
+                "pincode": pincode, "lat": lat + rng.uniform(-0.05, 0.05), "lon": lon + rng.uniform(-0.05, 0.05),
+                "emergency_capacity": capacity, "cur_emergency_availability": rng.randint(0, capacity),
+            })
+        insert_chunks(db, app_module.Hospital, hospitals)
+
+        doctors = []
+        doctor_slots = {}
+        hospital_depts = set()
+        on_duty = []
+        doc_id = 0
+        for hosp in hospitals:
+            for _ in range(scale["doctors_per_hospital"]):
+                doc_id += 1
+                dept_id = rng.choice(dept_ids)
+                slots = sorted(rng.sample(SLOTS, rng.randint(2, 5)))
+                doctor_slots[doc_id] = (hosp["id"], slots)
+                hospital_depts.add((hosp["id"], dept_id))
+                doctors.append({
+                    "id": doc_id, "name": f"Doctor {doc_id}", "department_id": dept_id,
+                    "qualification": rng.choice(QUALIFICATIONS), "experience": rng.randint(1, 35),
+                    "hospital_id": hosp["id"], "slots": slots,
+                })
+                if rng.random() < 0.3:
+                    on_duty.append({"hospital_id": hosp["id"], "doctor_id": doc_id})
+        insert_chunks(db, app_module.Doctor, doctors)
+        insert_chunks(db, app_module.HospitalDepartment, ({"hospital_id": h, "department_id": d} for h, d in sorted(hospital_depts)))
+        insert_chunks(db, app_module.EmergencyDoctor, on_duty)
+
+        patients = []
+        for i in range(1, scale["patients"] + 1):
+            pincode = rng.choice(pincodes)
+            lat, lon = centroids[pincode]
+            patients.append({
+                "id": i, "email": f"patient{i}@bench.test", "fname": f"Patient{i}", "lname": "Bench",
+                "dob": date(1950, 1, 1) + timedelta(days=rng.randint(0, 25000)), "phone": f"98{i:08d}",
+                "password": "bench", "pincode": pincode, "lat": lat, "lon": lon,
+            })
+        insert_chunks(db, app_module.Patient, patients)
+        app_module.build_pincode_centroids()
+
+        def appointments():
+            taken = set()
+            appt_id = 0
+            while appt_id < scale["appointments"]:
+                doctor = rng.randint(1, doc_id)
+                hosp_id, slots = doctor_slots[doctor]
+                day = today + timedelta(days=rng.randint(-730, 60))
+                slot = rng.choice(slots)
+                if (doctor, day, slot) in taken:
+                    continue
+                taken.add((doctor, day, slot))
+                appt_id += 1
+                yield {
+                    "id": appt_id, "patient_id": rng.randint(1, scale["patients"]), "fname": "Bench", "lname": "Patient",
+                    "doctor_id": doctor, "hospital_id": hosp_id, "appointment_date": day, "appointment_slot": slot,
+                    "status": "Pending" if day >= today else rng.choice(["Completed", "Completed", "Pending", "No-show"]),
+                }
+
+        appts = list(appointments())
+        insert_chunks(db, app_module.Appointment, appts)
+        insert_chunks(db, app_module.SlotReservation, (
+            {"doctor_id": a["doctor_id"], "appointment_date": a["appointment_date"], "appointment_slot": a["appointment_slot"], "appointment_id": a["id"]}
+            for a in appts
+        ))
+
+        now = datetime.now()
+        insert_chunks(db, app_module.EmergencyBooking, (
+            {
+                "patient_name": f"Walk-in {i}", "dob": date(1980, 1, 1), "phone": "9000000000", "email": f"walkin{i}@bench.test",
+                "address": "Bench", "pincode": rng.choice(pincodes), "hospital_id": rng.randint(1, scale["hospitals"]),
+                "booking_time": now - timedelta(minutes=rng.randint(0, 60 * 24 * 365)), "reason": rng.choice(REASONS),
+            }
+            for i in range(scale["bookings"])
+        ))
+
+        app_module.rebuild_rollups()
+
+        counts = {
+            "hospitals": len(hospitals), "doctors": doc_id, "patients": len(patients),
+            "appointments": len(appts), "bookings": scale["bookings"], "pincodes": len(pincodes),
+        }
+    return counts
+
+
+def open_dataset(path, scale, seed=0, reuse=False):
+    # returns the app module bound to a generated database at `path`
+    if os.path.exists(path) and not reuse:
+        os.remove(path)
+    fresh = not os.path.exists(path)
+    app_module = load_app(f"sqlite:///{os.path.abspath(path)}")
+    app_module.init_db(app_module.app)
+    if fresh:
+        generate(app_module, scale, seed)
+    return app_module
+
+
+def add_scale_arguments(parser):
+    for name, value in default_scale().items():
+        parser.add_argument(f"--{name.replace('_', '-')}", type=int, default=value)
+    parser.add_argument("--seed", type=int, default=0)
+
+
+def scale_from_args(args):
+    return {name: getattr(args, name) for name in default_scale()}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--db", required=True, help="SQLite file to (re)create")
+    add_scale_arguments(parser)
+    args = parser.parse_args()
+    start = time.perf_counter()
+    open_dataset(args.db, scale_from_args(args), args.seed)
+    print(f"generated {args.db} in {time.perf_counter() - start:.1f}s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,111 @@
+"""Memory and lookup cost of the in-memory doctor directory.
+
+Loads the directory under tracemalloc to report what it holds per worker,
+times how long another worker takes to catch up on one changed doctor, then
+times the lookups it serves (doctors by department, doctors of a hospital in a
+department, a department's id from its name) against the SQL they replaced.
+The default scale is 100k doctors.
+
+    python -m benchmarks.directory --db /tmp/bench.db --reuse --lookups 2000
+"""
+import argparse
+import random
+import time
+import tracemalloc
+
+from benchmarks.common import latency_summary, write_report
+from benchmarks.dataset import add_scale_arguments, open_dataset, scale_from_args
+
+
+def timed(func, args):
+    samples = []
+    for arg in args:
+        start = time.perf_counter()
+        func(*arg)
+        samples.append(time.perf_counter() - start)
+    return latency_summary(samples)
+
+
+def run(app_module, lookups=2000, seed=0):
+    rng = random.Random(seed)
+    db = app_module.db
+    Doctor, Departments = app_module.Doctor, app_module.Departments
+    with app_module.app.app_context():
+        tracemalloc.start()
+        start = time.perf_counter()
+        directory = app_module.get_doctor_directory()
+        load_s = time.perf_counter() - start
+        memory, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+        doctors = len(directory.doctors)
+
+        # a second worker's copy catching up on one logged change, where it
+        # used to reload everything
+        peer = app_module.VersionedCache(app_module.directory_cache.name, app_module.load_doctor_directory, app_module.refresh_doctor_directory)
+        peer.get()
+        app_module.directory_cache.record(doctors=[rng.choice(list(directory.doctors))])
+        app_module.directory_cache.bump()
+        db.session.commit()
+        peer.expire()
+        start = time.perf_counter()
+        peer.get()
+        catch_up_s = time.perf_counter() - start
+        del peer
+        dept_ids = list(directory.departments)
+        dept_names = [dept.name for dept in directory.departments.values()]
+        hosp_ids = list(directory.by_hospital)
+        by_dept = [(rng.choice(dept_ids),) for _ in range(lookups)]
+        by_hospital = [(rng.choice(dept_ids), rng.choice(hosp_ids)) for _ in range(lookups)]
+        by_name = [(rng.choice(dept_names),) for _ in range(lookups)]
+
+        def sql_by_dept(dept_id):
+            return db.session.query(Doctor.id, Doctor.name, Doctor.hospital_id).filter(Doctor.department_id == dept_id).order_by(Doctor.id).all()
+
+        def sql_by_hospital(dept_id, hosp_id):
+            return Doctor.query.filter(Doctor.department_id == dept_id, Doctor.hospital_id == hosp_id).all()
+
+        def sql_by_name(name):
+            return Departments.query.filter(Departments.name == name).first()
+
+        return {
+            "doctors": doctors,
+            "departments": len(dept_ids),
+            "hospitals": len(directory.hospitals),
+            "load_s": round(load_s, 3),
+            "catch_up_ms": round(catch_up_s * 1000, 3),
+            "memory_mb": round(memory / 2**20, 2),
+            "peak_load_mb": round(peak / 2**20, 2),
+            "bytes_per_doctor": round(memory / doctors) if doctors else None,
+            "by_department": {
+                "directory": timed(directory.doctors_in, by_dept),
+                "sql": timed(sql_by_dept, by_dept[:lookups // 10 or 1]),
+            },
+            "by_hospital_department": {
+                "directory": timed(directory.doctors_in, by_hospital),
+                "sql": timed(sql_by_hospital, by_hospital),
+            },
+            "department_by_name": {
+                "directory": timed(directory.department_ids.get, by_name),
+                "sql": timed(sql_by_name, by_name),
+            },
+            "get_doctors_payload": timed(app_module.department_doctors, by_dept),
+        }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--db", default="bench.db", help="SQLite file holding the synthetic dataset")
+    parser.add_argument("--reuse", action="store_true", help="reuse an existing --db instead of regenerating it")
+    parser.add_argument("--lookups", type=int, default=2000)
+    parser.add_argument("--out", help="also write the JSON report to this file")
+    add_scale_arguments(parser)
+    parser.set_defaults(doctors_per_hospital=100)
+    args = parser.parse_args()
+    app_module = open_dataset(args.db, scale_from_args(args), args.seed, reuse=args.reuse)
+    report = dict(run(app_module, args.lookups, args.seed), scale=scale_from_args(args))
+    write_report(report, args.out)
+
+
+if __name__ == "__main__":
+    main()
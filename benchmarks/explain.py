@@ -0,0 +1,156 @@
+"""Print EXPLAIN QUERY PLAN for every SQL statement the routes issue.
+
+Runs each route through the Flask test client against a scratch copy of the
+database, records the statements through a SQLAlchemy event hook and flags any
+filtered query whose plan still contains a full table scan.
+
+    python -m benchmarks.explain
+    python -m benchmarks.explain --db instance/hospitalizee.db
+"""
+import argparse
+import os
+import re
+import shutil
+import tempfile
+
+from benchmarks.common import ROOT
+
+DEFAULT_DB = os.path.join(ROOT, "instance", "hospitalizee.db")
+
+
+def load_scratch_app(source):
+    scratch = os.path.join(tempfile.mkdtemp(prefix="hospitalizee-explain-"), "hospitalizee.db")
+    if os.path.exists(source):
+        shutil.copy(source, scratch)
+    os.environ["DATABASE_URL"] = f"sqlite:///{scratch}"
+    from benchmarks.common import load_app
+    app_module = load_app()
+    app_module.init_db(app_module.app)
+    return app_module
+
+
+def sample_ids(app_module):
+    with app_module.app.app_context():
+        db = app_module.db
+        hospital = app_module.Hospital.query.first()
+        patient = app_module.Patient.query.first()
+        doctor = app_module.Doctor.query.filter_by(hospital_id=hospital.id).first() if hospital else None
+        dept = db.session.get(app_module.Departments, doctor.department_id) if doctor else app_module.Departments.query.first()
+        appt = app_module.Appointment.query.first()
+        return {
+            "hospital": hospital.id if hospital else 1,
+            "pincode": hospital.pincode if hospital else 0,
+            "lat": hospital.lat if hospital and hospital.lat is not None else 22.57,
+            "lon": hospital.lon if hospital and hospital.lon is not None else 88.36,
+            "patient": patient.id if patient else 1,
+            "doctor": doctor.id if doctor else 1,
+            "dept_id": dept.id if dept else 1,
+            "dept": dept.name if dept else "Cardiology",
+            "appt": appt.id if appt else 0,
+        }
+
+
+def route_calls(ids):
+    emergency = {
+        "fname": "A", "lname": "B", "dob": "1990-01-01", "phone": "1", "email": "a@b.c",
+        "address": "x", "pincode": str(ids["pincode"]),
+    }
+    return [
+        ("GET", "/", {}, None),
+        ("GET", "/patient/new-appointment", {}, None),
+        ("POST", "/patient/login", {"patient_id": ids["patient"]}, {"email": "nobody@example.com", "password": "x"}),
+        ("GET", f"/patient/dashboard?user_id={ids['patient']}", {}, None),
+        ("GET", f"/get-doctors/{ids['dept_id']}", {}, None),
+        ("GET", f"/get-slots/{ids['doctor']},{ids['hospital']}?date=2030-01-01", {}, None),
+        ("POST", "/patient/confirm-appointment", {"patient_id": ids["patient"]},
+         {"fname": "A", "lname": "B", "date": "2030-01-01", "doct_id": f"{ids['doctor']},{ids['hospital']}", "slot": "explain"}),
+        ("GET", f"/patient/cancel-appointment?app_id={ids['appt']}&user_id={ids['patient']}", {}, None),
+        ("POST", "/hospital/login", {}, {"email": "nobody@example.com", "password": "x"}),
+        ("GET", f"/hospital/dashboard?user_id={ids['hospital']}", {}, None),
+        ("GET", f"/hospital/dashboard/emergency-doctors?user_id={ids['hospital']}", {}, None),
+        ("GET", f"/hospital/dashboard/emergency/add-doctor?user_id={ids['hospital']}&doc_id={ids['doctor']}", {}, None),
+        ("GET", f"/hospital/dashboard/emergency/remove-doctor?user_id={ids['hospital']}&doc_id={ids['doctor']}", {}, None),
+        ("GET", "/hospital/new-doctor", {"hospital_id": ids["hospital"]}, None),
+        ("POST", "/hospital/new-department", {"hospital_id": ids["hospital"]}, {"name": ids["dept"]}),
+        ("POST", "/hospital/update-beds/occupied", {"user_id": ids["hospital"]}, {"occupied": "0"}),
+        ("POST", "/hospital/update-beds/total", {"user_id": ids["hospital"]}, {"total": "10"}),
+        ("GET", f"/hospital/view-department?h_id={ids['hospital']}&dept={ids['dept']}", {}, None),
+        ("POST", "/emergency_hosp", {}, dict(emergency, emergency_reason="chest pain and palpitation", lat=str(ids["lat"]), long=str(ids["lon"]))),
+        ("POST", "/emergency_hosp", {}, dict(emergency, emergency_reason="chest pain and palpitation")),
+        ("POST", "/emergency_hosp", {}, dict(emergency, emergency_reason="feeling unwell", lat=str(ids["lat"]), long=str(ids["lon"]))),
+        ("POST", f"/emergency/book-emergency?fname=A&lname=B&dob=1990-01-01&phone=1&email=a&address=x&pincode={ids['pincode']}&reason=explain", {},
+         {"hospital_id": str(ids["hospital"])}),
+    ]
+
+
+def capture(app_module, calls):
+    from sqlalchemy import event
+
+    statements = {}
+    current = []
+
+    def record(conn, cursor, statement, parameters, context, executemany):
+        if statement.lstrip().upper().startswith(("SELECT", "UPDATE", "DELETE")) and not executemany:
+            statements.setdefault(statement, (parameters, set()))[1].add(current[0])
+
+    with app_module.app.app_context():
+        engine = app_module.db.engine
+    event.listen(engine, "before_cursor_execute", record)
+    try:
+        for method, url, session_values, form in calls:
+            client = app_module.app.test_client()
+            if session_values:
+                with client.session_transaction() as sess:
+                    sess.update(session_values)
+            current[:] = [f"{method} {url.split('?')[0]}"]
+            client.open(url, method=method, data=form)
+    finally:
+        event.remove(engine, "before_cursor_execute", record)
+    return statements, engine
+
+
+def explain(engine, statements, tables):
+    results = []
+    raw = engine.raw_connection()
+    try:
+        cursor = raw.cursor()
+        for statement, (parameters, routes) in statements.items():
+            cursor.execute("EXPLAIN QUERY PLAN " + statement, parameters)
+            plan = [row[-1] for row in cursor.fetchall()]
+            filtered = re.search(r"\bWHERE\b", statement, re.IGNORECASE) is not None
+            # "SCAN anon_1" and friends walk subquery results, not tables
+            scans = [line for line in plan if line.startswith("SCAN") and "INDEX" not in line and line.split()[1] in tables]
+            results.append({
+                "routes": sorted(routes),
+                "statement": " ".join(statement.split()),
+                "plan": plan,
+                "full_scan": filtered and bool(scans),
+            })
+    finally:
+        raw.close()
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--db", default=DEFAULT_DB, help="SQLite database to copy for the run")
+    args = parser.parse_args()
+
+    app_module = load_scratch_app(args.db)
+    statements, engine = capture(app_module, route_calls(sample_ids(app_module)))
+    results = explain(engine, statements, set(app_module.db.metadata.tables))
+
+    for result in results:
+        marker = "FULL SCAN" if result["full_scan"] else "ok"
+        print(f"[{marker}] {', '.join(result['routes'])}")
+        print(f"    {result['statement']}")
+        for line in result["plan"]:
+            print(f"      {line}")
+    flagged = [r for r in results if r["full_scan"]]
+    print(f"\n{len(results)} statements, {len(flagged)} filtered full scans")
+    if flagged:
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
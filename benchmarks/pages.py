@@ -0,0 +1,66 @@
+"""Per-request CPU of the cached pages with the page cache on and off.
+
+Renders each page --requests times through the test client with
+PAGE_CACHE off (Jinja on every hit), on (cached body), on with gzip, and
+as a conditional GET answered with 304, and reports CPU time per request.
+
+    python -m benchmarks.pages --db /tmp/bench.db --reuse --requests 2000
+"""
+import argparse
+import time
+
+from benchmarks.common import write_report
+from benchmarks.dataset import add_scale_arguments, open_dataset, scale_from_args
+
+PAGES = ["/", "/about", "/patient/new-appointment", "/hospital/new-department", "/hospital/update-beds/occupied", "/hospital/update-beds/total"]
+
+
+def cpu_per_request(client, path, requests, headers):
+    client.get(path, headers=headers)
+    start = time.process_time()
+    for _ in range(requests):
+        response = client.get(path, headers=headers)
+        assert response.status_code in (200, 304), (path, response.status_code)
+    return (time.process_time() - start) / requests * 1000
+
+
+def run(app_module, requests=1000):
+    app = app_module.app
+    client = app.test_client()
+    with client.session_transaction() as sess:
+        sess["hospital_id"] = sess["user_id"] = 1
+    report = {}
+    for path in PAGES:
+        app.config["PAGE_CACHE"] = False
+        uncached = cpu_per_request(client, path, requests, {})
+        app.config["PAGE_CACHE"] = True
+        cached = cpu_per_request(client, path, requests, {})
+        gzipped = cpu_per_request(client, path, requests, {"Accept-Encoding": "gzip"})
+        etag = client.get(path).headers["ETag"]
+        revalidated = cpu_per_request(client, path, requests, {"If-None-Match": etag})
+        report[path] = {
+            "uncached_cpu_ms": round(uncached, 4),
+            "cached_cpu_ms": round(cached, 4),
+            "cached_gzip_cpu_ms": round(gzipped, 4),
+            "not_modified_cpu_ms": round(revalidated, 4),
+            "cpu_reduction": f"{(1 - cached / uncached) * 100:.0f}%",
+            "bytes": len(client.get(path).data),
+            "gzip_bytes": len(client.get(path, headers={"Accept-Encoding": "gzip"}).data),
+        }
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--db", default="bench.db", help="SQLite file holding the synthetic dataset")
+    parser.add_argument("--reuse", action="store_true", help="reuse an existing --db instead of regenerating it")
+    parser.add_argument("--requests", type=int, default=1000, help="timed requests per page and mode")
+    parser.add_argument("--out", help="also write the JSON report to this file")
+    add_scale_arguments(parser)
+    args = parser.parse_args()
+    app_module = open_dataset(args.db, scale_from_args(args), args.seed, reuse=args.reuse)
+    write_report({"requests": args.requests, "pages": run(app_module, args.requests)}, args.out)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,63 @@
+"""Batch nearest-hospital ranking against one recommend_hospitals call per incident.
+
+Ranks --incidents random incidents both ways on a seeded dataset, checks that
+every incident gets the same department and general picks, and reports the
+time per incident for each.
+
+    python -m benchmarks.ranking --db /tmp/bench.db --reuse --incidents 5000
+"""
+import argparse
+import random
+import time
+
+from benchmarks.common import write_report
+from benchmarks.dataset import REASONS, add_scale_arguments, open_dataset, scale_from_args
+
+
+def run(app_module, incidents=2000, seed=0):
+    rng = random.Random(seed)
+    batch = [(rng.choice(REASONS), rng.uniform(8, 34), rng.uniform(69, 95)) for _ in range(incidents)]
+    with app_module.app.app_context():
+        # warm the indexes so neither side pays for loading them
+        app_module.get_hospital_index()
+        app_module.get_emergency_index()
+
+        start = time.perf_counter()
+        single = []
+        for reason, lat, lon in batch:
+            dept, conf = app_module.classify_emergency(reason)
+            dept_hospitals, hospitals = app_module.recommend_hospitals(dept, conf, lat, lon, None)
+            single.append(([h.id for h in dept_hospitals], [h.id for h in hospitals]))
+        single_s = time.perf_counter() - start
+
+        start = time.perf_counter()
+        ranked = app_module.recommend_hospitals_batch(batch)
+        batch_s = time.perf_counter() - start
+
+    batched = [([h for h, d in dept_ranked], [h for h, d in general]) for dept, conf, dept_ranked, general in ranked]
+    mismatches = sum(a != b for a, b in zip(single, batched))
+    return {
+        "incidents": incidents,
+        "numpy": app_module.np is not None,
+        "single_ms_per_incident": round(single_s / incidents * 1000, 4),
+        "batch_ms_per_incident": round(batch_s / incidents * 1000, 4),
+        "speedup": round(single_s / batch_s, 1) if batch_s else None,
+        "mismatches": mismatches,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--db", default="bench.db", help="SQLite file holding the synthetic dataset")
+    parser.add_argument("--reuse", action="store_true", help="reuse an existing --db instead of regenerating it")
+    parser.add_argument("--incidents", type=int, default=2000)
+    parser.add_argument("--out", help="also write the JSON report to this file")
+    add_scale_arguments(parser)
+    args = parser.parse_args()
+    app_module = open_dataset(args.db, scale_from_args(args), args.seed, reuse=args.reuse)
+    report = dict(run(app_module, args.incidents, args.seed), scale=scale_from_args(args))
+    write_report(report, args.out)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,209 @@
+"""Per-route throughput and latency against a seeded synthetic dataset.
+
+Drives the Flask routes through the test client (default) or a running
+server (--url, e.g. a local gunicorn pointed at the same --db) and prints a
+JSON report keyed by route, suitable for diffing between runs.
+
+    python -m benchmarks.routes --db /tmp/bench.db --hospitals 10000 --appointments 1000000
+    python -m benchmarks.routes --db /tmp/bench.db --reuse --requests 500 --out routes.json
+
+With ENFORCE_QUERY_BUDGET=1 a route that runs over its query budget answers
+500, so it shows up in the report as errors.
+"""
+import argparse
+import http.cookiejar
+import json
+import random
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+from datetime import date, timedelta
+
+from benchmarks.common import latency_summary, write_report
+from benchmarks.dataset import REASONS, SLOTS, add_scale_arguments, open_dataset, scale_from_args
+
+
+class TestClient:
+    def __init__(self, app):
+        self.client = app.test_client()
+
+    def request(self, method, path, data=None, payload=None):
+        return self.client.open(path, method=method, data=data, json=payload).status_code
+
+
+class HttpClient:
+    def __init__(self, base_url):
+        self.base_url = base_url.rstrip("/")
+        self.opener = urllib.request.build_opener(urllib.request.HTTPCookieProcessor(http.cookiejar.CookieJar()))
+
+    def request(self, method, path, data=None, payload=None):
+        body = urllib.parse.urlencode(data).encode() if data is not None else None
+        headers = {}
+        if payload is not None:
+            body = json.dumps(payload).encode()
+            headers["Content-Type"] = "application/json"
+        req = urllib.request.Request(self.base_url + path, data=body, headers=headers, method=method)
+        try:
+            with self.opener.open(req) as response:
+                response.read()
+                return response.status
+        except urllib.error.HTTPError as e:
+            return e.code
+
+
+def emergency_form(rng, ctx, reason, with_location=True):
+    form = {
+        "fname": "Bench", "lname": "Patient", "dob": "1990-01-01", "phone": "9000000000",
+        "email": "bench@bench.test", "address": "Bench Road", "pincode": str(rng.choice(ctx["pincodes"])),
+        "emergency_reason": reason,
+    }
+    if with_location:
+        form["lat"] = str(rng.uniform(8, 34))
+        form["long"] = str(rng.uniform(69, 95))
+    return form
+
+
+def hospital_form(rng, ctx):
+    # a fresh gid and email each time, registration rejects repeats
+    n = rng.getrandbits(48)
+    return {
+        "gid": f"BENCH-{n}", "email": f"hospital-{n}@bench.test", "password": "bench", "name": "Bench Hospital",
+        "phone": "9000000000", "address": "Bench Road", "pincode": str(rng.choice(ctx["pincodes"])),
+        "lat": str(rng.uniform(8, 34)), "long": str(rng.uniform(69, 95)), "emergency_capacity": "10",
+    }
+
+
+def emergency_json(rng, ctx, reason, with_location=True):
+    body = {"reason": reason, "pincode": rng.choice(ctx["pincodes"])}
+    if with_location:
+        body["lat"] = rng.uniform(8, 34)
+        body["lon"] = rng.uniform(69, 95)
+    return body
+
+
+# minimum requests/sec a route has to sustain; reported next to the measured
+# rate so a regression shows up as meets_target: false
+TARGETS = {
+    "POST /api/emergency/recommendations (gps)": 100,
+    "POST /api/emergency/recommendations (pincode)": 200,
+}
+
+
+def scenarios(ctx):
+    # name -> (client kind, function(rng) -> (method, path, form[, payload]))
+    counts = ctx["counts"]
+    today = date.today()
+    patient = lambda rng: rng.randint(1, counts["patients"])
+    hospital = lambda rng: rng.randint(1, counts["hospitals"])
+    doctor = lambda rng: rng.randint(1, counts["doctors"])
+    day = lambda rng: (today + timedelta(days=rng.randint(1, 60))).isoformat()
+    return {
+        "GET /": ("anon", lambda rng: ("GET", "/", None)),
+        "GET /about": ("anon", lambda rng: ("GET", "/about", None)),
+        "GET /patient/new-appointment": ("anon", lambda rng: ("GET", "/patient/new-appointment", None)),
+        "GET /patient/dashboard": ("anon", lambda rng: ("GET", f"/patient/dashboard?user_id={patient(rng)}", None)),
+        "GET /patient/appointments": ("anon", lambda rng: ("GET", f"/patient/appointments?user_id={patient(rng)}", None)),
+        "GET /get-doctors": ("anon", lambda rng: ("GET", f"/get-doctors/{rng.choice(ctx['dept_ids'])}", None)),
+        "GET /get-slots": ("anon", lambda rng: ("GET", f"/get-slots/{doctor(rng)}?date={day(rng)}", None)),
+        "POST /patient/confirm-appointment": ("patient", lambda rng: ("POST", "/patient/confirm-appointment", {
+            "fname": "Bench", "lname": "Patient", "date": day(rng), "slot": rng.choice(SLOTS),
+            "doct_id": (lambda d: f"{d},{ctx['doctor_hospitals'][d]}")(doctor(rng)),
+        })),
+        "GET /hospital/dashboard": ("anon", lambda rng: ("GET", f"/hospital/dashboard?user_id={hospital(rng)}", None)),
+        "GET /hospital/dashboard/emergency-doctors": ("anon", lambda rng: ("GET", f"/hospital/dashboard/emergency-doctors?user_id={hospital(rng)}", None)),
+        "GET /hospital/analytics": ("anon", lambda rng: ("GET", f"/hospital/analytics?user_id={hospital(rng)}", None)),
+        "GET /hospital/view-department": ("anon", lambda rng: ("GET", f"/hospital/view-department?h_id={hospital(rng)}&dept={urllib.parse.quote(rng.choice(ctx['dept_names']))}", None)),
+        "POST /emergency_hosp (gps, department)": ("anon", lambda rng: ("POST", "/emergency_hosp", emergency_form(rng, ctx, rng.choice(REASONS[:-1])))),
+        "POST /emergency_hosp (gps, general)": ("anon", lambda rng: ("POST", "/emergency_hosp", emergency_form(rng, ctx, "high fever"))),
+        "POST /emergency_hosp (pincode)": ("anon", lambda rng: ("POST", "/emergency_hosp", emergency_form(rng, ctx, rng.choice(REASONS), with_location=False))),
+        "POST /api/emergency/recommendations (gps)": ("anon", lambda rng: ("POST", "/api/emergency/recommendations", None, emergency_json(rng, ctx, rng.choice(REASONS)))),
+        "POST /api/emergency/recommendations (pincode)": ("anon", lambda rng: ("POST", "/api/emergency/recommendations", None, emergency_json(rng, ctx, rng.choice(REASONS), with_location=False))),
+        "POST /emergency/book-emergency": ("anon", lambda rng: ("POST",
+            f"/emergency/book-emergency?fname=Bench&lname=Patient&dob=1990-01-01&phone=9000000000&email=bench%40bench.test&address=Bench&pincode={rng.choice(ctx['pincodes'])}&reason=chest+pain",
+            {"hospital_id": str(hospital(rng))})),
+        "POST /hospital/register (gps)": ("anon", lambda rng: ("POST", "/hospital/register", hospital_form(rng, ctx))),
+    }
+
+
+def make_clients(app_module, url):
+    if not url:
+        # start warm, as create_app() does for a server
+        with app_module.app.app_context():
+            app_module.warm_caches()
+    new_client = (lambda: HttpClient(url)) if url else (lambda: TestClient(app_module.app))
+    patient = new_client()
+    patient.request("POST", "/patient/login", {"email": "patient1@bench.test", "password": "bench"})
+    patient.request("GET", "/patient/dashboard")
+    return {"anon": new_client(), "patient": patient}
+
+
+def context(app_module):
+    with app_module.app.app_context():
+        db = app_module.db
+        depts = app_module.Departments.query.all()
+        return {
+            "counts": {
+                "patients": db.session.query(db.func.max(app_module.Patient.id)).scalar(),
+                "hospitals": db.session.query(db.func.max(app_module.Hospital.id)).scalar(),
+                "doctors": db.session.query(db.func.max(app_module.Doctor.id)).scalar(),
+            },
+            "dept_ids": [d.id for d in depts],
+            "dept_names": [d.name for d in depts],
+            "pincodes": [row[0] for row in db.session.query(app_module.Hospital.pincode).distinct()],
+            "doctor_hospitals": dict(db.session.query(app_module.Doctor.id, app_module.Doctor.hospital_id).all()),
+        }
+
+
+def run_routes(app_module, requests=200, seed=0, url=None, only=None, warmup=5):
+    rng = random.Random(seed)
+    clients = make_clients(app_module, url)
+    results = {}
+    for name, (kind, build) in scenarios(context(app_module)).items():
+        if only and not any(part in name for part in only):
+            continue
+        client = clients[kind]
+        for _ in range(warmup):
+            client.request(*build(rng))
+        samples = []
+        errors = 0
+        for _ in range(requests):
+            call = build(rng)
+            start = time.perf_counter()
+            status = client.request(*call)
+            samples.append(time.perf_counter() - start)
+            errors += status >= 400
+        results[name] = dict(latency_summary(samples), errors=errors)
+        if name in TARGETS:
+            results[name]["target_per_sec"] = TARGETS[name]
+            results[name]["meets_target"] = results[name]["per_sec"] >= TARGETS[name]
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--db", default="bench.db", help="SQLite file holding the synthetic dataset")
+    parser.add_argument("--reuse", action="store_true", help="reuse an existing --db instead of regenerating it")
+    parser.add_argument("--requests", type=int, default=200, help="timed requests per route")
+    parser.add_argument("--url", help="benchmark a running server instead of the test client")
+    parser.add_argument("--only", action="append", help="only run routes whose name contains this (repeatable)")
+    parser.add_argument("--out", help="also write the JSON report to this file")
+    add_scale_arguments(parser)
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    app_module = open_dataset(args.db, scale_from_args(args), args.seed, reuse=args.reuse)
+    setup = time.perf_counter() - start
+    report = {
+        "mode": "http" if args.url else "test_client",
+        "scale": scale_from_args(args),
+        "seed": args.seed,
+        "setup_s": round(setup, 2),
+        "requests_per_route": args.requests,
+        "routes": run_routes(app_module, args.requests, args.seed, args.url, args.only),
+    }
+    write_report(report, args.out)
+
+
+if __name__ == "__main__":
+    main()
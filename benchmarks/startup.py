@@ -0,0 +1,72 @@
+"""Cold-start cost of a worker: import, create_app() and the first requests.
+
+Each run is a fresh interpreter, like a new gunicorn worker or an autoscaled
+instance, against a scratch copy of the database.
+
+    python -m benchmarks.startup --runs 10
+"""
+import argparse
+import json
+import os
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+
+from benchmarks.common import ROOT, write_report
+
+PROBE = r"""
+import json, sys, time
+start = time.perf_counter()
+sys.path.insert(0, sys.argv[1])
+import app
+imported = time.perf_counter()
+app.create_app()
+created = time.perf_counter()
+client = app.app.test_client()
+client.get("/")
+first = time.perf_counter()
+client.get("/hospital/dashboard?user_id=1")
+db_first = time.perf_counter()
+print(json.dumps({
+    "import_ms": (imported - start) * 1000,
+    "create_app_ms": (created - imported) * 1000,
+    "first_request_ms": (first - created) * 1000,
+    "first_db_request_ms": (db_first - first) * 1000,
+    "total_ms": (db_first - start) * 1000,
+    "google_auth_loaded": "google.auth" in sys.modules,
+}))
+"""
+
+
+def run(runs=5, source=None):
+    source = source or os.path.join(ROOT, "instance", "hospitalizee.db")
+    scratch = tempfile.mkdtemp(prefix="hospitalizee-startup-")
+    db_path = os.path.join(scratch, "hospitalizee.db")
+    if os.path.exists(source):
+        shutil.copy(source, db_path)
+    env = dict(os.environ, DATABASE_URL=f"sqlite:///{db_path}")
+    samples = []
+    for _ in range(runs):
+        out = subprocess.run([sys.executable, "-c", PROBE, ROOT], env=env, capture_output=True, text=True, check=True)
+        samples.append(json.loads(out.stdout.strip().splitlines()[-1]))
+    shutil.rmtree(scratch, ignore_errors=True)
+    report = {"runs": runs, "google_auth_loaded_at_startup": any(s["google_auth_loaded"] for s in samples)}
+    for key in ("import_ms", "create_app_ms", "first_request_ms", "first_db_request_ms", "total_ms"):
+        values = [s[key] for s in samples]
+        report[key] = {"median": round(statistics.median(values), 2), "max": round(max(values), 2)}
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--db", help="SQLite database to copy (defaults to instance/hospitalizee.db)")
+    parser.add_argument("--out", help="also write the JSON report to this file")
+    args = parser.parse_args()
+    write_report(run(args.runs, args.db), args.out)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,95 @@
+"""Offline Firebase ID-token fixtures and verification benchmark.
+
+Generates a throwaway RSA key and certificate, writes them as a key file for
+StaticKeyProvider and signs fixture ID tokens with it, so the verify-login
+routes can be exercised with no network access:
+
+    python -m benchmarks.tokens --keys /tmp/firebase-keys.json --tokens 1000
+    FIREBASE_AUTH_KEYS_FILE=/tmp/firebase-keys.json FIREBASE_PROJECT_ID=hospitalizee-bench flask --app app run
+"""
+import argparse
+import datetime
+import json
+import time
+
+from benchmarks.common import latency_summary, load_app, write_report
+
+PROJECT_ID = "hospitalizee-bench"
+KID = "bench-key"
+
+
+def make_keys(path):
+    from cryptography import x509
+    from cryptography.hazmat.primitives import hashes, serialization
+    from cryptography.hazmat.primitives.asymmetric import rsa
+    from cryptography.x509.oid import NameOID
+
+    key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+    name = x509.Name([x509.NameAttribute(NameOID.COMMON_NAME, "hospitalizee-bench")])
+    now = datetime.datetime.now(datetime.timezone.utc)
+    cert = (
+        x509.CertificateBuilder()
+        .subject_name(name).issuer_name(name).public_key(key.public_key())
+        .serial_number(x509.random_serial_number())
+        .not_valid_before(now - datetime.timedelta(days=1)).not_valid_after(now + datetime.timedelta(days=30))
+        .sign(key, hashes.SHA256())
+    )
+    with open(path, "w") as f:
+        json.dump({KID: cert.public_bytes(serialization.Encoding.PEM).decode()}, f)
+    return key.private_bytes(serialization.Encoding.PEM, serialization.PrivateFormat.PKCS8, serialization.NoEncryption()).decode()
+
+
+def sign_token(private_pem, email, project_id=PROJECT_ID, lifetime=3600):
+    from google.auth import crypt, jwt
+
+    now = int(time.time())
+    signer = crypt.RSASigner.from_string(private_pem, key_id=KID)
+    claims = {
+        "iss": f"https://securetoken.google.com/{project_id}", "aud": project_id, "auth_time": now,
+        "sub": email, "email": email, "iat": now, "exp": now + lifetime,
+    }
+    return jwt.encode(signer, claims).decode()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--keys", default="firebase-keys.json", help="where to write the {kid: certificate} key file")
+    parser.add_argument("--tokens", type=int, default=500, help="distinct fixture tokens to sign")
+    parser.add_argument("--repeat", type=int, default=5, help="logins per token, to exercise the verified-token cache")
+    parser.add_argument("--out", help="also write the JSON report to this file")
+    args = parser.parse_args()
+
+    private_pem = make_keys(args.keys)
+    tokens = [sign_token(private_pem, f"patient{i}@bench.test") for i in range(args.tokens)]
+
+    app_module = load_app()
+    verifier = app_module.TokenVerifier(app_module.StaticKeyProvider(args.keys), PROJECT_ID)
+    cold, warm = [], []
+    for token in tokens:
+        start = time.perf_counter()
+        verifier.verify(token)
+        cold.append(time.perf_counter() - start)
+    for _ in range(args.repeat - 1):
+        for token in tokens:
+            start = time.perf_counter()
+            verifier.verify(token)
+            warm.append(time.perf_counter() - start)
+
+    rejected = 0
+    for bad in (sign_token(private_pem, "x@bench.test", project_id="someone-else"), tokens[0][:-4] + "AAAA"):
+        try:
+            verifier.verify(bad)
+        except Exception:
+            rejected += 1
+
+    write_report({
+        "tokens": args.tokens,
+        "first_verification": latency_summary(cold),
+        "cached_verification": latency_summary(warm),
+        "bad_tokens_rejected": f"{rejected}/2",
+        "keys_file": args.keys,
+    }, args.out)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,130 @@
+"""Throughput and accuracy harness for the emergency triage classifier.
+
+    python -m benchmarks.triage
+    python -m benchmarks.triage --impl mymodule:classify --size 50000 --out triage.json
+"""
+import argparse
+import json
+import os
+import random
+import re
+import time
+
+from benchmarks.common import latency_summary, load_app, load_callable, write_report
+
+FIXTURES = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures", "triage_labels.jsonl")
+
+FILLERS = [
+    "patient reports", "since morning", "for two days", "severe", "mild", "after a fall at home",
+    "history of diabetes", "elderly", "child", "sudden", "with fever", "no known allergies",
+    "brought by family", "on the road", "at work", "and", "with", "worsening",
+]
+
+
+def reference_classify(text, rules=None):
+    # the original per-keyword implementation, kept as the ground truth for output drift
+    rules = rules or load_app().DEPARTMENT_RULES
+    text = text.lower()
+    scores = {}
+    for dept, keywords in rules.items():
+        score = sum(1 for kw in keywords if re.search(rf"\b{kw}\b", text))
+        if score > 0:
+            scores[dept] = score
+    if not scores:
+        return "General Medicine", 0.55
+    best_dept = max(scores, key=scores.get)
+    confidence = min(0.95, 0.6 + scores[best_dept] * 0.1)
+    return best_dept, round(confidence, 2)
+
+
+def generate_corpus(rules, size, seed=0):
+    rng = random.Random(seed)
+    keywords = [kw for kws in rules.values() for kw in kws]
+    corpus = []
+    for _ in range(size):
+        words = rng.sample(FILLERS, rng.randint(1, 5))
+        words += [rng.choice(keywords) for _ in range(rng.randint(0, 4))]
+        rng.shuffle(words)
+        text = " ".join(words)
+        if rng.random() < 0.2:
+            text = text.capitalize() + "."
+        corpus.append(text)
+    return corpus
+
+
+def load_fixtures(path=FIXTURES):
+    with open(path) as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def time_calls(classify, corpus):
+    samples = []
+    results = []
+    for text in corpus:
+        start = time.perf_counter()
+        results.append(classify(text))
+        samples.append(time.perf_counter() - start)
+    return results, samples
+
+
+def confusion_matrix(fixtures, classify):
+    matrix = {}
+    correct = 0
+    for row in fixtures:
+        predicted = classify(row["text"])[0]
+        matrix.setdefault(row["dept"], {})
+        matrix[row["dept"]][predicted] = matrix[row["dept"]].get(predicted, 0) + 1
+        correct += predicted == row["dept"]
+    return matrix, round(correct / len(fixtures), 4) if fixtures else 0.0
+
+
+def run(impl="app:classify_emergency", size=20000, seed=0, fixtures_path=FIXTURES):
+    app = load_app()
+    classify = load_callable(impl)
+    corpus = generate_corpus(app.DEPARTMENT_RULES, size, seed)
+
+    results, samples = time_calls(classify, corpus)
+    expected, ref_samples = time_calls(lambda text: reference_classify(text, app.DEPARTMENT_RULES), corpus)
+    mismatches = [
+        {"text": text, "expected": list(e), "got": list(r)}
+        for text, e, r in zip(corpus, expected, results) if tuple(e) != tuple(r)
+    ]
+
+    fixtures = load_fixtures(fixtures_path)
+    matrix, accuracy = confusion_matrix(fixtures, classify)
+
+    report = {
+        "impl": impl,
+        "corpus": {"size": size, "seed": seed},
+        "latency": latency_summary(samples),
+        "reference_latency": latency_summary(ref_samples),
+        "mismatches": len(mismatches),
+        "mismatch_examples": mismatches[:10],
+        "fixtures": {"path": os.path.relpath(fixtures_path), "count": len(fixtures), "accuracy": accuracy},
+        "confusion_matrix": matrix,
+    }
+    if hasattr(app, "classify_emergency_batch") and impl == "app:classify_emergency":
+        start = time.perf_counter()
+        batch = app.classify_emergency_batch(corpus)
+        elapsed = time.perf_counter() - start
+        report["batch_per_sec"] = round(size / elapsed, 1) if elapsed else 0.0
+        report["batch_mismatches"] = sum(tuple(b) != tuple(r) for b, r in zip(batch, results))
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--impl", default="app:classify_emergency", help="classifier to benchmark, as module:function")
+    parser.add_argument("--size", type=int, default=20000, help="number of synthetic emergency reasons")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--fixtures", default=FIXTURES, help="labelled JSONL fixture set")
+    parser.add_argument("--out", help="also write the JSON report to this file")
+    args = parser.parse_args()
+    report = run(args.impl, args.size, args.seed, args.fixtures)
+    write_report(report, args.out)
+    if report["mismatches"] or report.get("batch_mismatches"):
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
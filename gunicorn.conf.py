@@ -0,0 +1,23 @@
+import os
+
+# gunicorn app:app still works; this config loads the app once in the master
+# (migrations, imports) and forks workers from it
+wsgi_app = "app:create_app()"
+preload_app = True
+
+# threaded workers so a slow emergency lookup does not hold up other requests
+# on the same worker; the in-memory indexes are shared by a worker's threads
+worker_class = "gthread"
+threads = int(os.environ.get("GUNICORN_THREADS", 4))
+
+
+# background jobs run on threads inside each worker: start them after the fork
+# and let a stopping worker finish what is due before it exits
+def post_fork(server, worker):
+    from app import job_queue
+    job_queue.start()
+
+
+def worker_exit(server, worker):
+    from app import job_queue
+    job_queue.stop()